@@ -3,7 +3,13 @@ from django.contrib.auth.admin import UserAdmin
 from .models import User, OneTimePassword, Business, Balancesheet, Blog, Testimonial, ContactRequest, ViewHistory,\
     ChatbotRequest, ChatbotNotification
 from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 from rest_framework.authtoken.models import Token
+from .exports import CONTACT_REQUEST_COLUMNS, CHATBOT_REQUEST_COLUMNS, stream_csv
 
 
 # De-register all models from other apps
@@ -31,6 +37,86 @@ class CustomUserAdmin(UserAdmin):
     ordering = ('email',)
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Takes the planner's row estimate instead of COUNT(*) for unfiltered changelists of big tables
+    """
+    estimate_above = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row is not None and row[0] > self.estimate_above:
+                return int(row[0])
+        return super().count
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Sidebar filter with a text box instead of one link per related row
+    """
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # a single dummy lookup, so the filter is shown
+        return ((),)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            try:
+                return queryset.filter(**{self.lookup: self.value()})
+            except (ValueError, ValidationError):
+                return queryset.none()
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = (
+            (k, v) for k, v in changelist.get_filters_params().items() if k != self.parameter_name
+        )
+        yield all_choice
+
+
+class BusinessIdFilter(InputFilter):
+    title = 'business id'
+    parameter_name = 'business_id'
+    lookup = 'business_id'
+
+
+class RequestedByEmailFilter(InputFilter):
+    title = 'requested by email'
+    parameter_name = 'requested_by_email'
+    lookup = 'requested_by__email'
+
+
+class PostedByEmailFilter(InputFilter):
+    title = 'posted by email'
+    parameter_name = 'posted_by_email'
+    lookup = 'posted_by__email'
+
+
+class ScalableAdminMixin:
+    """
+    Changelist settings for tables with 100k+ rows: estimated counts and numeric search terms
+    matched exactly against numeric_search_fields
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    numeric_search_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit() and self.numeric_search_fields:
+            number = int(term)
+            return queryset.filter(Q(*[Q(**{field: number}) for field in self.numeric_search_fields],
+                                     _connector=Q.OR)), False
+        return super().get_search_results(request, queryset, search_term)
+
+
 # Register your models here.
 class CustomBalancesheetAdmin(admin.ModelAdmin):
     list_display = ('business', 'uploaded_on',)
@@ -45,27 +131,57 @@ class CustomBalancesheetAdmin(admin.ModelAdmin):
 #     list_filter = ('user', 'balancesheet',)
 
 
-class CustomBusinessAdmin(admin.ModelAdmin):
+class CustomBusinessAdmin(ScalableAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'business_name', 'posted_by', 'is_verified',)
+    list_select_related = ('posted_by',)
     ordering = ('id', 'verified_by')
-    list_filter = ('is_verified', 'state', 'industry', 'company_type', 'sub_type')
-    search_fields = ('id', 'business_name', 'state', 'company_type', 'company_type_others_description', 'sub_type',
-                     'sub_type_others_description', 'industry', 'industries_others_description', 'verified_by')
+    list_filter = ('is_verified', 'state', 'industry', 'company_type', 'sub_type', PostedByEmailFilter)
+    # choice fields are covered by list_filter, numbers are matched against the id
+    search_fields = ('business_name', '=verified_by')
+    numeric_search_fields = ('id',)
+    autocomplete_fields = ('posted_by',)
+
+
+class CSVExportMixin:
+    """
+    Adds an "Export selected as CSV" action, use "select all" to export the whole filtered changelist
+    """
+    csv_columns = ()
+    actions = ['export_csv']
 
+    def export_csv(self, request, queryset):
+        return stream_csv(queryset, self.csv_columns, self.model._meta.model_name)
+    export_csv.short_description = 'Export selected as CSV'
 
-class CustomContactRequestAdmin(admin.ModelAdmin):
+
+class CustomContactRequestAdmin(CSVExportMixin, ScalableAdminMixin, admin.ModelAdmin):
+    csv_columns = CONTACT_REQUEST_COLUMNS
     list_display = ('id', 'business', 'requested_by', 'created_at', 'processed', 'processed_by', 'status')
+    list_select_related = ('business', 'requested_by')
     ordering = ('id', 'created_at')
-    list_filter = ('processed', 'business', 'requested_by', 'created_at', 'processed_by')
-    search_fields = ('id', 'business', 'requested_by', 'created_at', 'processed', 'processed_by', 'status')
+    list_filter = ('processed', BusinessIdFilter, RequestedByEmailFilter, 'created_at', 'processed_by')
+    # numbers are matched against the request id, business id and requester's mobile
+    search_fields = ('=requested_by__email', '=processed_by')
+    numeric_search_fields = ('id', 'business_id', 'requested_by__mobile')
+    autocomplete_fields = ('business', 'requested_by')
 
 
-class CustomChatbotRequestAdmin(admin.ModelAdmin):
+class CustomChatbotRequestAdmin(CSVExportMixin, admin.ModelAdmin):
+    csv_columns = CHATBOT_REQUEST_COLUMNS
     ordering = ('id', 'created_at')
     list_filter = ('processed', 'created_at', 'processed_by')
     search_fields = ('id', 'name', 'email', 'mobile', 'processed', 'processed_by', 'status')
 
 
+class CustomViewHistoryAdmin(ScalableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'business', 'viewed_by', 'viewed_at')
+    list_select_related = ('business', 'viewed_by')
+    list_filter = (BusinessIdFilter,)
+    search_fields = ('=viewed_by__email',)
+    numeric_search_fields = ('id', 'business_id')
+    autocomplete_fields = ('business', 'viewed_by')
+
+
 admin.site.register(User, CustomUserAdmin)
 # admin.site.register(OneTimePassword)
 admin.site.register(Business, CustomBusinessAdmin)
@@ -75,5 +191,5 @@ admin.site.register(Blog)
 admin.site.register(Testimonial)
 admin.site.register(ContactRequest, CustomContactRequestAdmin)
 admin.site.register(ChatbotRequest, CustomChatbotRequestAdmin)
-admin.site.register(ViewHistory)
+admin.site.register(ViewHistory, CustomViewHistoryAdmin)
 admin.site.register(ChatbotNotification)
@@ -0,0 +1,105 @@
+"""
+Min/max of the business price and capital fields, for the filter sidebar.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+
+from .models import BusinessListing
+
+
+# response key suffix -> Business field
+BOUND_FIELDS = (
+    ('selling_price', 'admin_defined_selling_price'),
+    ('auth_capital', 'authorised_capital'),
+    ('paidup_capital', 'paidup_capital'),
+)
+
+
+class BusinessBounds:
+    """
+    One cached record holding the min and max of ``BOUND_FIELDS`` over verified businesses. Writes
+    that may move the bounds drop it and the next read recomputes it with a single aggregate query.
+    The record is never patched in place, a read-modify-write on the shared cache would let
+    concurrent saves on two instances overwrite each other.
+    """
+    cache_key = 'corpmart:business-bounds'
+
+    def get_timeout(self):
+        return getattr(settings, 'CORPMART_BUSINESS_BOUNDS_TIMEOUT', 300)
+
+    def compute(self):
+        aggregates = {}
+        for name, field in BOUND_FIELDS:
+            aggregates[f"max_{name}"] = Max(field)
+            aggregates[f"min_{name}"] = Min(field)
+        # the listing holds exactly the verified businesses, its (field, id) indexes answer each min/max
+        return BusinessListing.objects.aggregate(**aggregates)
+
+    @staticmethod
+    def etag(values):
+        return '"%s"' % hashlib.md5(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+    def get(self):
+        """
+        Returns the bounds and their etag.
+        """
+        record = cache.get(self.cache_key)
+        if record is None:
+            values = self.compute()
+            record = {'values': values, 'etag': self.etag(values)}
+            cache.set(self.cache_key, record, self.get_timeout())
+        return record['values'], record['etag']
+
+    def invalidate(self):
+        cache.delete(self.cache_key)
+
+    @staticmethod
+    def _loaded_values(business):
+        # deferred fields are left out rather than loaded, the row may be gone already
+        deferred = business.get_deferred_fields()
+        return {field: getattr(business, field) for field in ('is_verified',) + tuple(f for _, f in BOUND_FIELDS)
+                if field not in deferred}
+
+    @staticmethod
+    def _is_extreme(values, business_values):
+        # a field that wasn't loaded may have held any of the bounds
+        return any(field not in business_values or
+                   (business_values[field] is not None and
+                    business_values[field] in (values[f"max_{name}"], values[f"min_{name}"]))
+                   for name, field in BOUND_FIELDS)
+
+    @staticmethod
+    def _widens(values, business_values):
+        return any(business_values.get(field) is not None and
+                   (values[f"max_{name}"] is None or business_values[field] > values[f"max_{name}"] or
+                    values[f"min_{name}"] is None or business_values[field] < values[f"min_{name}"])
+                   for name, field in BOUND_FIELDS)
+
+    def business_saved(self, business, created, previous):
+        """
+        ``previous`` are the values the business had in the database before the save, None if unknown.
+        """
+        record = cache.get(self.cache_key)
+        if record is None:
+            return
+        values = record['values']
+        current = self._loaded_values(business)
+        if not created and (previous is None or
+                            (previous.get('is_verified', True) and self._is_extreme(values, previous))):
+            # the business may have been one of the bounds
+            self.invalidate()
+        elif current.get('is_verified', True) and self._widens(values, current):
+            self.invalidate()
+
+    def business_deleted(self, business):
+        record = cache.get(self.cache_key)
+        loaded = self._loaded_values(business)
+        if record is not None and loaded.get('is_verified', True) and self._is_extreme(record['values'], loaded):
+            self.invalidate()
+
+
+business_bounds = BusinessBounds()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class CorpmartConfig(AppConfig):
     name = 'corpmart'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,3 @@
+"""
+Benchmarks for the corpmart api, run through the ``benchmark_*`` management commands.
+"""
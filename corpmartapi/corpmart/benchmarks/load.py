@@ -0,0 +1,188 @@
+"""
+A concurrent in-process load generator for the public endpoints.
+
+Requests go straight to the views through ``APIRequestFactory``, so a run measures the application and
+the database without a web server in between. Every worker thread holds its own database connection,
+which is why the dataset has to be committed before a run rather than seeded in a rolled back
+transaction like the other benchmarks.
+"""
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from ..facets import SORT_OPTIONS
+from ..models import Business
+from ..views import BusinessListViewset, BusinessDetailViewset, MaxValueView, BlogViewset, PostBusiness, \
+    ContactRequest
+from .synthetic import STATE_WEIGHTS, INDUSTRY_WEIGHTS, WORDS, business_payload
+
+PERCENTILES = (50, 95, 99)
+
+
+class Scenario:
+    """
+    One kind of request. ``build(rng)`` returns the request parameters (or body for posts).
+    """
+
+    def __init__(self, name, view, path, build, weight, method='get', authenticated=False):
+        self.name = name
+        self.view = view
+        self.path = path
+        self.build = build
+        self.weight = weight
+        self.method = method
+        self.authenticated = authenticated
+
+
+def business_list_params(rng):
+    params = {}
+    roll = rng.random()
+    if roll < 0.3:
+        params['state'] = rng.choice(list(STATE_WEIGHTS))
+    elif roll < 0.5:
+        params['industry'] = rng.choice(list(INDUSTRY_WEIGHTS))
+    elif roll < 0.6:
+        params['search'] = rng.choice(WORDS)
+    elif roll < 0.7:
+        params['selling_price_max'] = rng.choice((10, 25, 50, 100)) * 100000
+    if rng.random() < 0.5:
+        params['sort_by'] = rng.choice(list(SORT_OPTIONS))
+    if rng.random() < 0.1:
+        params['page'] = rng.randint(2, 20)
+    return params
+
+
+def default_scenarios(business_ids):
+    """
+    The read/write mix of the site: mostly listing browsing and detail views, few writes.
+    """
+    # every contact request needs a business the benchmark user hasn't contacted yet
+    contactable = itertools.cycle(business_ids)
+    return [
+        Scenario('business list', BusinessListViewset.as_view({'get': 'list'}), '/businesses/',
+                 business_list_params, weight=50),
+        Scenario('business detail', BusinessDetailViewset.as_view({'get': 'list'}), '/business-detail/',
+                 lambda rng: {'business_id': rng.choice(business_ids)}, weight=25, authenticated=True),
+        Scenario('max value', MaxValueView.as_view(), '/max-value/', lambda rng: {}, weight=10),
+        Scenario('blog list', BlogViewset.as_view({'get': 'list'}), '/blogs/',
+                 lambda rng: {'summary': ''} if rng.random() < 0.5 else {}, weight=10),
+        Scenario('post business', PostBusiness.as_view(), '/post-business/', business_payload, weight=3,
+                 method='post', authenticated=True),
+        Scenario('contact request', ContactRequest.as_view(), '/contact-request/',
+                 lambda rng: {'business': next(contactable)}, weight=2, method='post', authenticated=True),
+    ]
+
+
+def percentile(ordered, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return None
+    rank = max(0, -(-len(ordered) * percent // 100) - 1)
+    return ordered[int(rank)]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+    summary = {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[2]),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else None,
+        'max_ms': round(latencies[-1], 3) if latencies else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'max_queries': max(queries) if queries else None,
+    }
+    for percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        summary[f'p{percent}_ms'] = round(value, 3) if value is not None else None
+    return summary
+
+
+class LoadRunner:
+    """
+    Sends ``requests`` requests drawn from the weighted scenarios through ``concurrency`` threads and
+    records latency, query count and status of each.
+    """
+
+    def __init__(self, scenarios, user, concurrency=8, seed=0):
+        self.scenarios = scenarios
+        self.weights = [scenario.weight for scenario in scenarios]
+        self.user = user
+        self.concurrency = concurrency
+        self.seed = seed
+        self.factory = APIRequestFactory()
+
+    def send(self, scenario, rng):
+        payload = scenario.build(rng)
+        if scenario.method == 'post':
+            request = self.factory.post(scenario.path, payload, format='json')
+        else:
+            request = self.factory.get(scenario.path, payload)
+        if scenario.authenticated:
+            force_authenticate(request, user=self.user)
+        response = scenario.view(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response.status_code
+
+    def worker(self, index, count, samples, lock):
+        rng = random.Random(self.seed * 1000 + index)
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        local = []
+        try:
+            with connection.execute_wrapper(count_queries):
+                for _ in range(count):
+                    scenario = rng.choices(self.scenarios, self.weights)[0]
+                    del queries[:]
+                    start = time.perf_counter()
+                    try:
+                        error = self.send(scenario, rng) >= 400
+                    except Exception:
+                        error = True
+                    local.append((scenario.name, (time.perf_counter() - start) * 1000, len(queries), error))
+        finally:
+            connection.close()
+        with lock:
+            samples.extend(local)
+
+    def run(self, requests):
+        samples = []
+        lock = threading.Lock()
+        per_worker = [requests // self.concurrency + (index < requests % self.concurrency)
+                      for index in range(self.concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.worker, index, count, samples, lock)
+                       for index, count in enumerate(per_worker)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        by_scenario = defaultdict(list)
+        for name, *sample in samples:
+            by_scenario[name].append(sample)
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'overall': summarize([sample for name, *sample in samples], elapsed),
+            'scenarios': {name: summarize(scenario_samples, elapsed)
+                          for name, scenario_samples in sorted(by_scenario.items())},
+        }
+
+
+def verified_business_ids(limit=100000, seed=0):
+    ids = list(Business.objects.filter(is_verified=True).values_list('id', flat=True))
+    return random.Random(seed).sample(ids, min(limit, len(ids)))
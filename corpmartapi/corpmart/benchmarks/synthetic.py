@@ -0,0 +1,96 @@
+"""
+Synthetic business listings with choice distributions skewed the way real listings are.
+"""
+import random
+
+from ..models import User, Business, BusinessListing, Blog
+
+
+BENCHMARK_EMAIL = 'benchmark@corpmart.invalid'
+BENCHMARK_MOBILE = 9000000000
+
+# most listings come from a handful of states and industries
+STATE_WEIGHTS = {'Maharashtra': 20, 'National Capital Territory of Delhi': 16, 'Karnataka': 10, 'Gujarat': 8,
+                 'Tamil Nadu': 7, 'Uttar Pradesh': 6, 'Telangana': 5, 'West Bengal': 4}
+INDUSTRY_WEIGHTS = {'IT & ITES': 18, 'TRADING': 12, 'SERVICES': 10, 'MANUFACTURING': 9, 'CONSULTING': 8,
+                    'FINANCIAL SERVICES': 6, 'REAL ESTATE': 5, 'ECOMMERCE': 5}
+COMPANY_TYPE_WEIGHTS = {'Pvt. Ltd.': 70, 'Limited Liability Partnership (LLP)': 15, 'Partnership Firm': 8}
+WORDS = ('profitable', 'running', 'shelf', 'company', 'clean', 'books', 'compliant', 'gst', 'registered',
+         'export', 'licence', 'bank', 'account', 'turnover', 'clients', 'office', 'private', 'limited')
+
+
+def _weighted(rng, choices, weights):
+    values = [value for value, _ in choices]
+    return rng.choices(values, [weights.get(value, 1) for value in values])[0]
+
+
+def benchmark_user():
+    user, created = User.objects.get_or_create(email=BENCHMARK_EMAIL, defaults={'mobile': BENCHMARK_MOBILE})
+    return user
+
+
+def make_businesses(count, posted_by, seed=0, verified_ratio=0.9):
+    """
+    Yields unsaved ``Business`` instances, deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        authorised_capital = rng.choice((1, 5, 10, 25, 50, 100, 500)) * 100000
+        paidup_capital = int(authorised_capital * rng.uniform(0.1, 1))
+        price = int(paidup_capital * rng.uniform(0.2, 3))
+        yield Business(
+            is_verified=rng.random() < verified_ratio,
+            posted_by=posted_by,
+            business_name=f"Synthetic {rng.randrange(10 ** 9)} Pvt. Ltd.",
+            state=_weighted(rng, Business.STATE_LIST, STATE_WEIGHTS),
+            company_type=_weighted(rng, Business.COMPANY_TYPE_LIST, COMPANY_TYPE_WEIGHTS),
+            sub_type=rng.choice(Business.SUB_TYPE_LIST)[0] if rng.random() < 0.2 else None,
+            industry=_weighted(rng, Business.INDUSTRY_LIST, INDUSTRY_WEIGHTS),
+            sale_description=" ".join(rng.choices(WORDS, k=rng.randint(5, 40))),
+            year_of_incorporation=rng.randint(1980, 2020) if rng.random() < 0.95 else None,
+            has_gst_number=rng.random() < 0.7,
+            has_import_export_code=rng.random() < 0.3,
+            has_bank_account=rng.random() < 0.85,
+            has_other_license=rng.random() < 0.1,
+            authorised_capital=authorised_capital,
+            paidup_capital=paidup_capital,
+            user_defined_selling_price=price,
+            admin_defined_selling_price=price,
+        )
+
+
+def seed_businesses(count, seed=0, batch_size=5000):
+    posted_by = benchmark_user()
+    created = Business.objects.bulk_create(make_businesses(count, posted_by, seed), batch_size=batch_size)
+    Business.objects.filter(id__in=[business.id for business in created]).update_search_vector()
+    BusinessListing.objects.refresh([business.id for business in created])
+    return posted_by
+
+
+def make_blogs(count, seed=0):
+    """
+    Yields unsaved ``Blog`` instances without pictures.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield Blog(
+            blog_title=" ".join(rng.choices(WORDS, k=rng.randint(3, 8))).capitalize(),
+            blog_text=" ".join(rng.choices(WORDS, k=rng.randint(300, 1200))),
+            posted_by=BENCHMARK_EMAIL,
+        )
+
+
+def seed_blogs(count, seed=0):
+    Blog.objects.bulk_create(make_blogs(count, seed))
+
+
+def business_payload(rng):
+    """
+    A listing as the post business form submits it.
+    """
+    business = next(make_businesses(1, None, seed=rng.randrange(10 ** 9)))
+    return {field: getattr(business, field) for field in (
+        'business_name', 'state', 'company_type', 'sub_type', 'industry', 'sale_description',
+        'year_of_incorporation', 'has_gst_number', 'has_import_export_code', 'has_bank_account',
+        'has_other_license', 'authorised_capital', 'paidup_capital', 'user_defined_selling_price',
+    ) if getattr(business, field) is not None}
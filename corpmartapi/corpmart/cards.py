@@ -0,0 +1,120 @@
+"""
+Pre-encoded JSON of the business cards shown by the business list.
+
+A card is the ``BusinessListingSerializer`` output of one listing, rendered to JSON bytes once and
+reused until the listing's ``version`` changes. ``CardJSONRenderer`` splices the cached bytes of a page
+into the response without serializing any of its fields again.
+"""
+import threading
+
+from cachetools import LRUCache
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import timed_serialization
+from .models import BusinessListing
+
+
+class Cards(list):
+    """
+    A page of pre-encoded cards, rendered as a JSON array by ``CardJSONRenderer``.
+    """
+
+
+class CardJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that writes ``Cards`` found as the data or as a top level value of it verbatim.
+    """
+    placeholder = '__corpmart_cards_{}__'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Cards):
+            return b'[' + b','.join(data) + b']'
+        if not isinstance(data, dict) or not any(isinstance(value, Cards) for value in data.values()):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # render everything else normally with a placeholder string where the cards go
+        pages = {}
+        rendered = {}
+        for key, value in data.items():
+            if isinstance(value, Cards):
+                placeholder = self.placeholder.format(len(pages))
+                pages[placeholder] = value
+                value = placeholder
+            rendered[key] = value
+        output = super().render(rendered, accepted_media_type, renderer_context)
+        for placeholder, cards in pages.items():
+            output = output.replace(f'"{placeholder}"'.encode(), b'[' + b','.join(cards) + b']', 1)
+        return output
+
+
+class CardCache:
+    """
+    Per process LRU of ``business id -> (listing version, card bytes)``. A listing's version is the id of
+    the transaction that last wrote it and is never reused, even for a listing deleted and inserted
+    again, so every instance notices stale cards on its own; ``invalidate`` only frees the memory early.
+    Lookups and encoding count as serializer time in the request metrics.
+    """
+    def __init__(self, maxsize=None):
+        self._cache = LRUCache(maxsize or getattr(settings, 'CORPMART_CARD_CACHE_SIZE', 50000))
+        self._lock = threading.Lock()
+        self._renderer = JSONRenderer()
+
+    def encode(self, card):
+        return self._renderer.render(card)
+
+    def cards(self, versions, serializer_class):
+        """
+        The cards of ``versions``, an ordered list of (business id, listing version) pairs. Missing or
+        outdated cards are serialized from one query for their listings.
+        """
+        found = {}
+        with timed_serialization(), self._lock:
+            for business_id, version in versions:
+                entry = self._cache.get(business_id)
+                if entry is not None and entry[0] == version:
+                    found[business_id] = entry[1]
+
+        missing = [business_id for business_id, version in versions if business_id not in found]
+        if missing:
+            listings = list(BusinessListing.objects.only('version', *serializer_class.Meta.fields)
+                            .filter(id__in=missing))
+            found.update(self._encode(listings, serializer_class))
+        return Cards(found[business_id] for business_id, version in versions if business_id in found)
+
+    def cards_for_listings(self, listings, serializer_class):
+        """
+        The cards of already loaded listings, serializing only those not cached at their version.
+        """
+        listings = list(listings)
+        found = {}
+        with timed_serialization(), self._lock:
+            for listing in listings:
+                entry = self._cache.get(listing.id)
+                if entry is not None and entry[0] == listing.version:
+                    found[listing.id] = entry[1]
+        found.update(self._encode([listing for listing in listings if listing.id not in found], serializer_class))
+        return Cards(found[listing.id] for listing in listings)
+
+    def _encode(self, listings, serializer_class):
+        """
+        Serializes and caches the cards of a list of listings, returns them by business id.
+        """
+        with timed_serialization():
+            cards = {listing.id: self.encode(card)
+                     for listing, card in zip(listings, serializer_class(listings, many=True).data)}
+        with self._lock:
+            for listing in listings:
+                self._cache[listing.id] = (listing.version, cards[listing.id])
+        return cards
+
+    def invalidate(self, business_id):
+        with self._lock:
+            self._cache.pop(business_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+card_cache = CardCache()
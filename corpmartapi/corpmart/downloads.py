@@ -0,0 +1,57 @@
+"""
+Chunked, range aware file streaming that works against any django storage.
+"""
+import re
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Returns the inclusive (start, end) of a single ``bytes=`` range, None when there is no range to
+    honour. Multiple ranges are answered with the whole file, which RFC 7233 allows.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # suffix range, the last n bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def iter_range(storage, name, start, end, chunk_size):
+    """
+    Yields bytes ``start`` to ``end`` (inclusive) of a stored file, ``chunk_size`` bytes at a time.
+    Storages with an ``iter_range`` of their own fetch only the requested bytes, others are opened
+    and seeked.
+    """
+    if hasattr(storage, 'iter_range'):
+        yield from storage.iter_range(name, start, end, chunk_size)
+        return
+    with storage.open(name, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
@@ -0,0 +1,66 @@
+"""
+CSV exports of leads streamed straight from a server-side cursor.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+# column header -> lookup
+CONTACT_REQUEST_COLUMNS = (
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('business_id', 'business_id'),
+    ('business_name', 'business__business_name'),
+    ('business_state', 'business__state'),
+    ('business_industry', 'business__industry'),
+    ('selling_price', 'business__admin_defined_selling_price'),
+    ('first_name', 'requested_by__first_name'),
+    ('last_name', 'requested_by__last_name'),
+    ('email', 'requested_by__email'),
+    ('mobile', 'requested_by__mobile'),
+    ('organisation_name', 'requested_by__organisation_name'),
+    ('processed', 'processed'),
+    ('processed_by', 'processed_by'),
+    ('status', 'status'),
+)
+
+CHATBOT_REQUEST_COLUMNS = (
+    ('id', 'id'),
+    ('created_at', 'created_at'),
+    ('name', 'name'),
+    ('mobile', 'mobile'),
+    ('email', 'email'),
+    ('query', 'query'),
+    ('processed', 'processed'),
+    ('processed_by', 'processed_by'),
+    ('status', 'status'),
+)
+
+
+class Echo:
+    """
+    File-like object handing whatever csv.writer writes straight back.
+    """
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, columns, filename, chunk_size=2000):
+    """
+    Streams ``queryset`` as CSV, fetching ``chunk_size`` rows at a time through ``iterator()`` (a
+    server-side cursor on postgres) so the export never holds more than one chunk in memory.
+    """
+    writer = csv.writer(Echo())
+    header = [name for name, _ in columns]
+    rows = queryset.order_by('id').values_list(*(lookup for _, lookup in columns)).iterator(chunk_size=chunk_size)
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}-{timezone.now():%Y%m%d-%H%M%S}.csv"'
+    return response
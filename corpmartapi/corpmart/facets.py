@@ -0,0 +1,426 @@
+"""
+In-process facet index over verified businesses.
+
+Every verified business gets a slot number. Choice fields and boolean flags are kept as one bitmap
+(a plain python int) per value, numeric fields as sorted (value, id) arrays. A filter combination is
+answered by OR-ing the bitmaps of the requested values, bisecting the range arrays and AND-ing the
+results together, without touching the database.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from .models import Balancesheet, BusinessListing
+
+
+# query param -> Business field, for the comma separated "in" filters
+CHOICE_FILTERS = (
+    ('state', 'state'),
+    ('country', 'country'),
+    ('company_type', 'company_type'),
+    ('sub_type', 'sub_type'),
+    ('industry', 'industry'),
+)
+
+# query param -> Business field, for the boolean filters
+FLAG_FILTERS = (
+    ('gst', 'has_gst_number'),
+    ('bank', 'has_bank_account'),
+    ('import_export_code', 'has_import_export_code'),
+)
+
+# query param -> (Business field, lookup)
+RANGE_FILTERS = (
+    ('authorised_capital_max', 'authorised_capital', 'lte'),
+    ('authorised_capital_min', 'authorised_capital', 'gte'),
+    ('paidup_capital_max', 'paidup_capital', 'lte'),
+    ('paidup_capital_min', 'paidup_capital', 'gte'),
+    ('selling_price_max', 'admin_defined_selling_price', 'lte'),
+    ('selling_price_min', 'admin_defined_selling_price', 'gte'),
+)
+
+# sort_by -> (Business field, descending)
+SORT_OPTIONS = {
+    "1": ('year_of_incorporation', True),
+    "2": ('year_of_incorporation', False),
+    "3": ('authorised_capital', False),
+    "4": ('authorised_capital', True),
+    "5": ('paidup_capital', False),
+    "6": ('paidup_capital', True),
+    "7": ('admin_defined_selling_price', False),
+    "8": ('admin_defined_selling_price', True),
+}
+
+CHOICE_FIELDS = tuple(field for param, field in CHOICE_FILTERS)
+FLAG_FIELDS = ('has_gst_number', 'has_bank_account', 'has_import_export_code', 'has_other_license',
+               'has_balancesheet')
+RANGE_FIELDS = ('year_of_incorporation', 'authorised_capital', 'paidup_capital', 'admin_defined_selling_price')
+INDEXED_FIELDS = CHOICE_FIELDS + FLAG_FIELDS[:-1] + RANGE_FIELDS
+
+# facets the business list reports counts for through ?facets=
+FACETS = ('state', 'industry', 'company_type', 'sub_type') + FLAG_FIELDS
+
+_boolean_field = models.BooleanField()
+
+
+def popcount(bitmap):
+    return bin(bitmap).count('1')
+
+
+def iter_slots(bitmap):
+    """
+    Yields the positions of the set bits, lowest first.
+    """
+    bits = bin(bitmap)[:1:-1]
+    slot = bits.find('1')
+    while slot != -1:
+        yield slot
+        slot = bits.find('1', slot + 1)
+
+
+def _bitmap_from_slots(slots, size):
+    buffer = bytearray((size >> 3) + 1)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+class OrderedIds:
+    """
+    Lazily ordered list of business ids, only the slices actually paginated over get sorted.
+    """
+    def __init__(self, ids, sort_key=None, descending=False):
+        self.ids = ids
+        self.sort_key = sort_key
+        self.descending = descending
+
+    def __len__(self):
+        return len(self.ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop, step = item.indices(len(self.ids))
+        if self.sort_key is None:
+            ordered = heapq.nsmallest(stop, self.ids)
+        elif self.descending:
+            ordered = heapq.nlargest(stop, self.ids, key=self.sort_key)
+        else:
+            ordered = heapq.nsmallest(stop, self.ids, key=self.sort_key)
+        return ordered[start:stop:step]
+
+
+class FacetQuery:
+    """
+    Filters parsed from the business list query params. ``None`` from ``parse`` means the params can
+    not be answered from the index and the caller should fall back to the database.
+    """
+    def __init__(self):
+        self.choices = {}
+        self.flags = {}
+        self.ranges = []
+        self.balancesheet = False
+        self.sort = None
+        self.restrict_to = None
+
+    @classmethod
+    def parse(cls, query_params):
+        facet_query = cls()
+        try:
+            for param, field in CHOICE_FILTERS:
+                value = query_params.get(param)
+                if value is not None:
+                    facet_query.choices[field] = value.split(",")
+            for param, field in FLAG_FILTERS:
+                value = query_params.get(param)
+                if value is not None:
+                    facet_query.flags[field] = _boolean_field.to_python(value)
+            for param, field, lookup in RANGE_FILTERS:
+                value = query_params.get(param)
+                if value is not None:
+                    facet_query.ranges.append((field, lookup, int(value)))
+        except (ValueError, TypeError, ValidationError):
+            return None
+        facet_query.balancesheet = query_params.get('balancesheet') is not None
+        facet_query.sort = SORT_OPTIONS.get(query_params.get('sort_by'))
+        return facet_query
+
+
+def parse_facets(value):
+    """
+    ``facets=all`` asks for every facet, otherwise a comma separated list of facet names.
+    """
+    if not value:
+        return ()
+    if value in ('all', '1', 'true'):
+        return FACETS
+    requested = value.split(",")
+    return tuple(facet for facet in FACETS if facet in requested)
+
+
+class FacetIndex:
+    """
+    Bitmap index over verified businesses, built lazily from ``BusinessListing`` and kept up to date from
+    model signals. Every change also bumps a version in the shared cache; an instance that finds the
+    version moved past the writes it applied itself rebuilds on its next use, so writes handled by
+    another instance are picked up on the next request. Listing refreshes that bypass signals are
+    picked up after ``max_age`` seconds.
+    """
+    version_key = 'corpmart:facet-index:version'
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._version = None
+        self._reset()
+
+    def _reset(self):
+        self._slots = {}
+        self._ids = []
+        self._all = 0
+        self._values = {field: [] for field in INDEXED_FIELDS + ('has_balancesheet',)}
+        self._bitmaps = {field: {} for field in CHOICE_FIELDS + FLAG_FIELDS}
+        self._sorted = {field: [] for field in RANGE_FIELDS}
+
+    def _get_max_age(self):
+        if self.max_age is not None:
+            return self.max_age
+        return getattr(settings, 'CORPMART_FACET_INDEX_MAX_AGE', 300)
+
+    def shared_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            # start from the clock rather than 1, so a version evicted from the cache never comes back at a
+            # value an instance has already seen
+            cache.add(self.version_key, time.time_ns(), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def _publish(self, applied):
+        """
+        Bumps the shared version after a change. When ``applied`` the change is already reflected in this
+        index, which stays current unless another instance changed something since it was last in sync.
+        """
+        try:
+            version = cache.incr(self.version_key)
+        except ValueError:
+            cache.add(self.version_key, time.time_ns(), None)
+            version = None
+        if applied and version is not None and self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._built_at = None
+
+    @property
+    def is_stale(self):
+        return self._built_at is None or time.monotonic() - self._built_at > self._get_max_age() or \
+            self._version != self.shared_version()
+
+    def invalidate(self):
+        """
+        Drops this instance's index, for changes the other instances already know about.
+        """
+        with self._lock:
+            self._built_at = None
+
+    def invalidate_everywhere(self):
+        """
+        Drops the index of every instance, for writes that bypassed the signals.
+        """
+        with self._lock:
+            self._publish(applied=False)
+
+    def ensure_built(self):
+        with self._lock:
+            if self.is_stale:
+                self.rebuild()
+
+    def rebuild(self):
+        rows = BusinessListing.objects.order_by('id').values_list('id', *INDEXED_FIELDS, 'has_balancesheet')
+
+        with self._lock:
+            # read before the rows, a change committed while they are read moves it and rebuilds again
+            version = self.shared_version()
+            self._reset()
+            members = {field: {} for field in CHOICE_FIELDS + FLAG_FIELDS}
+            for slot, row in enumerate(rows.iterator(chunk_size=5000)):
+                business_id = row[0]
+                values = dict(zip(INDEXED_FIELDS + ('has_balancesheet',), row[1:]))
+                self._slots[business_id] = slot
+                self._ids.append(business_id)
+                for field, value in values.items():
+                    self._values[field].append(value)
+                for field in CHOICE_FIELDS + FLAG_FIELDS:
+                    members[field].setdefault(values[field], []).append(slot)
+                for field in RANGE_FIELDS:
+                    if values[field] is not None:
+                        self._sorted[field].append((values[field], business_id))
+
+            size = len(self._ids)
+            self._all = (1 << size) - 1
+            for field, value_slots in members.items():
+                self._bitmaps[field] = {value: _bitmap_from_slots(slots, size)
+                                        for value, slots in value_slots.items()}
+            for field in RANGE_FIELDS:
+                self._sorted[field].sort()
+            self._built_at = time.monotonic()
+            self._version = version
+
+    def _add(self, business_id, values):
+        slot = len(self._ids)
+        self._slots[business_id] = slot
+        self._ids.append(business_id)
+        bit = 1 << slot
+        self._all |= bit
+        for field, value in values.items():
+            self._values[field].append(value)
+        for field in CHOICE_FIELDS + FLAG_FIELDS:
+            bitmaps = self._bitmaps[field]
+            bitmaps[values[field]] = bitmaps.get(values[field], 0) | bit
+        for field in RANGE_FIELDS:
+            if values[field] is not None:
+                bisect.insort(self._sorted[field], (values[field], business_id))
+
+    def _remove(self, business_id):
+        # the slot stays allocated but cleared, it is reclaimed on the next rebuild
+        slot = self._slots.pop(business_id)
+        self._ids[slot] = None
+        mask = ~(1 << slot)
+        self._all &= mask
+        for field in CHOICE_FIELDS + FLAG_FIELDS:
+            value = self._values[field][slot]
+            self._bitmaps[field][value] &= mask
+        for field in RANGE_FIELDS:
+            value = self._values[field][slot]
+            if value is not None:
+                entries = self._sorted[field]
+                position = bisect.bisect_left(entries, (value, business_id))
+                if position < len(entries) and entries[position] == (value, business_id):
+                    del entries[position]
+        return slot
+
+    def update_business(self, business):
+        """
+        Reflects a saved business in the index. Instances with indexed fields left unloaded invalidate
+        the whole index since those values can not be trusted.
+        """
+        with self._lock:
+            if self._built_at is None or business.get_deferred_fields() & set(INDEXED_FIELDS + ('is_verified',)):
+                self._publish(applied=False)
+                return
+            has_balancesheet = False
+            if business.id in self._slots:
+                has_balancesheet = self._values['has_balancesheet'][self._slots[business.id]]
+                self._remove(business.id)
+            elif business.is_verified:
+                has_balancesheet = Balancesheet.objects.filter(business_id=business.id).exists()
+            if business.is_verified:
+                values = {field: getattr(business, field) for field in INDEXED_FIELDS}
+                values['has_balancesheet'] = has_balancesheet
+                self._add(business.id, values)
+            self._publish(applied=True)
+
+    def remove_business(self, business_id):
+        with self._lock:
+            if self._built_at is not None and business_id in self._slots:
+                self._remove(business_id)
+            self._publish(applied=self._built_at is not None)
+
+    def set_balancesheet(self, business_id, present):
+        with self._lock:
+            slot = self._slots.get(business_id)
+            if self._built_at is not None and slot is not None:
+                values = self._values['has_balancesheet']
+                bitmaps = self._bitmaps['has_balancesheet']
+                bit = 1 << slot
+                bitmaps[values[slot]] = bitmaps.get(values[slot], 0) & ~bit
+                values[slot] = present
+                bitmaps[present] = bitmaps.get(present, 0) | bit
+            self._publish(applied=self._built_at is not None)
+
+    def _range_bitmap(self, field, lookup, value):
+        entries = self._sorted[field]
+        if lookup == 'gte':
+            matches = entries[bisect.bisect_left(entries, (value,)):]
+        else:
+            matches = entries[:bisect.bisect_left(entries, (value + 1,))]
+        return _bitmap_from_slots((self._slots[business_id] for _, business_id in matches), len(self._ids))
+
+    def _field_bitmaps(self, facet_query):
+        """
+        Returns one bitmap per filtered field, AND-ing them gives the matching businesses.
+        """
+        bitmaps = {}
+        for field, values in facet_query.choices.items():
+            bitmap = 0
+            for value in values:
+                bitmap |= self._bitmaps[field].get(value, 0)
+            bitmaps[field] = bitmap
+        for field, value in facet_query.flags.items():
+            bitmaps[field] = self._bitmaps[field].get(value, 0)
+        for field, lookup, value in facet_query.ranges:
+            bitmaps[field, lookup] = self._range_bitmap(field, lookup, value)
+        if facet_query.balancesheet:
+            bitmaps['has_balancesheet'] = self._bitmaps['has_balancesheet'].get(True, 0)
+        if facet_query.restrict_to is not None:
+            slots = (self._slots[i] for i in facet_query.restrict_to if i in self._slots)
+            bitmaps['restrict_to'] = _bitmap_from_slots(slots, len(self._ids))
+        return bitmaps
+
+    def _match(self, bitmaps):
+        result = self._all
+        for bitmap in bitmaps.values():
+            result &= bitmap
+        return result
+
+    def _counts(self, bitmaps, facets):
+        # each facet is counted against every filter but its own, so selecting one state still
+        # reports how many businesses the other states would give
+        counts = {}
+        for field in facets:
+            base = self._match({key: bitmap for key, bitmap in bitmaps.items() if key != field})
+            counts[field] = {value: popcount(base & bitmap) for value, bitmap in self._bitmaps[field].items()
+                             if value is not None}
+        return counts
+
+    def _ordered(self, bitmap, sort, ranking=None):
+        # runs under the lock, the returned OrderedIds is sorted after it is released so it must not
+        # read the index's structures, which later writes change in place
+        slots = list(iter_slots(bitmap))
+        ids = [self._ids[slot] for slot in slots]
+        if sort is None and ranking is not None:
+            # search results without an explicit sort keep the order postgres ranked them in
+            positions = {business_id: position for position, business_id in enumerate(ranking)}
+            return OrderedIds(ids, positions.__getitem__)
+        if sort is None:
+            return OrderedIds(ids)
+        field, descending = sort
+        values = self._values[field]
+        # postgres puts nulls last in ascending and first in descending order
+        keys = {business_id: (values[slot] is None, values[slot] or 0, business_id)
+                for business_id, slot in zip(ids, slots)}
+        return OrderedIds(ids, keys.__getitem__, descending)
+
+    def filter(self, facet_query, facets=()):
+        """
+        Returns the ordered ids of the verified businesses matching ``facet_query`` together with the
+        per value counts of the requested ``facets``.
+        """
+        self.ensure_built()
+        with self._lock:
+            bitmaps = self._field_bitmaps(facet_query)
+            ids = self._ordered(self._match(bitmaps), facet_query.sort, facet_query.restrict_to)
+            return ids, self._counts(bitmaps, facets)
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,105 @@
+"""
+Resized WebP/JPEG derivatives of uploaded pictures, stored next to the original.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+
+
+def derivative_formats():
+    # extension, Pillow format; Pillow builds without libwebp only get JPEG
+    formats = [('jpg', 'JPEG')]
+    if features.check('webp'):
+        formats.insert(0, ('webp', 'WEBP'))
+    return formats
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f"{root}_w{width}.{extension}"
+
+
+def srcset(field_file, derivatives):
+    """
+    ``srcset`` strings per format for a picture, e.g. {"webp": "..._w320.webp 320w, ...", "jpg": ...}.
+    ``derivatives`` is the name of the picture the derivatives were generated for, None is returned
+    until that is the current picture so clients never get urls of files that don't exist yet.
+    """
+    if not field_file or field_file.name != derivatives:
+        return None
+    return {extension: ", ".join(f"{field_file.storage.url(derivative_name(field_file.name, width, extension))} "
+                                 f"{width}w" for width in DERIVATIVE_WIDTHS)
+            for extension, _ in derivative_formats()}
+
+
+class DerivativeGenerator:
+    """
+    Generates the derivatives of saved pictures on a small thread pool. Every width listed in the
+    srcset gets a file, pictures narrower than a width are stored at their own size under that name.
+    ``on_done(name)`` is called from the pool once all derivatives of ``name`` are stored.
+    """
+    def __init__(self, workers=None):
+        self._executor = ThreadPoolExecutor(max_workers=workers or getattr(settings, 'CORPMART_IMAGE_WORKERS', 2),
+                                            thread_name_prefix='image-derivatives')
+
+    def schedule(self, field_file, on_done=None):
+        if field_file:
+            self._executor.submit(self._log_errors, self.generate, field_file.storage, field_file.name, on_done)
+
+    def schedule_delete(self, field_file):
+        if field_file:
+            self._executor.submit(self._log_errors, self.delete, field_file.storage, field_file.name)
+
+    @staticmethod
+    def _log_errors(func, storage, name, on_done=None):
+        try:
+            func(storage, name)
+            if on_done is not None:
+                on_done(name)
+        except Exception:
+            logger.exception("Image derivatives failed for %s", name)
+
+    @staticmethod
+    def generate(storage, name):
+        names = [(width, extension, file_format, derivative_name(name, width, extension))
+                 for width in DERIVATIVE_WIDTHS for extension, file_format in derivative_formats()]
+        if all(storage.exists(derivative) for _, _, _, derivative in names):
+            return
+
+        with storage.open(name, 'rb') as f:
+            image = Image.open(f)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+
+        for width, extension, file_format, derivative in names:
+            resized = image
+            if image.width > width:
+                resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            if file_format == 'JPEG' or resized.mode not in ('RGB', 'RGBA'):
+                resized = resized.convert('RGB')
+            buffer = BytesIO()
+            resized.save(buffer, file_format, quality=80)
+            if storage.exists(derivative):
+                storage.delete(derivative)
+            storage.save(derivative, ContentFile(buffer.getvalue()))
+
+    @staticmethod
+    def delete(storage, name):
+        for width in DERIVATIVE_WIDTHS:
+            for extension, _ in derivative_formats():
+                derivative = derivative_name(name, width, extension)
+                if storage.exists(derivative):
+                    storage.delete(derivative)
+
+
+derivative_generator = DerivativeGenerator()
@@ -0,0 +1,254 @@
+"""
+Sampled per request timings: wall time, database queries, serializer time, response size and response
+cache hits, sent back as ``Server-Timing`` and aggregated per view into histograms for ``MetricsView``.
+
+Enable it with ``corpmart.instrumentation.PerformanceMiddleware`` in ``MIDDLEWARE`` and set
+``CORPMART_METRICS_SAMPLE_RATE`` (0 to 1, default 0.1) to the share of requests to measure.
+Requests that aren't sampled only pay for one random number.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# upper bounds of the histogram buckets per metric, +Inf is implied
+BUCKETS = {
+    'request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'db_duration_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    'db_queries': (0, 1, 2, 3, 5, 10, 20, 50, 100),
+    'serializer_duration_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    'response_size_bytes': (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+}
+HELP = {
+    'request_duration_seconds': "Wall time of sampled requests",
+    'db_duration_seconds': "Time spent in database queries per sampled request",
+    'db_queries': "Database queries per sampled request",
+    'serializer_duration_seconds': "Time spent serializing per sampled request",
+    'response_size_bytes': "Body size of sampled, non streaming responses",
+}
+PREFIX = 'corpmart_'
+
+_current = threading.local()
+
+
+class RequestMetrics:
+    """
+    What one sampled request spent its time on.
+    """
+
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.cache = None
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+def current_metrics():
+    """
+    The metrics of the request being handled by this thread, None when it isn't sampled.
+    """
+    return getattr(_current, 'metrics', None)
+
+
+def record_cache_result(hit):
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.cache = 'hit' if hit else 'miss'
+
+
+@contextmanager
+def timed_serialization():
+    """
+    Adds the time spent in the block to the serializer time of the current request, if it is sampled.
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += time.perf_counter() - start
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """
+    Histograms and counters per (view, method), kept in process. Each instance exposes its own numbers,
+    so the scraper has to hit every instance.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, metrics, duration, size, status_code):
+        values = {
+            'request_duration_seconds': duration,
+            'db_duration_seconds': metrics.db_time,
+            'db_queries': metrics.queries,
+            'serializer_duration_seconds': metrics.serializer_time,
+            'response_size_bytes': size,
+        }
+        counters = [('requests_sampled_total', labels + (('status', f'{status_code // 100}xx'),))]
+        if metrics.cache is not None:
+            counters.append(('response_cache_total', labels + (('result', metrics.cache),)))
+        with self._lock:
+            for name, value in values.items():
+                if value is None:
+                    continue
+                key = (name, labels)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(BUCKETS[name])
+                self._histograms[key].observe(value)
+            for key in counters:
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        with self._lock:
+            histograms = {key: (list(histogram.counts), histogram.sum, histogram.buckets)
+                          for key, histogram in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+        for name in BUCKETS:
+            series = sorted((labels, values) for (metric, labels), values in histograms.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {PREFIX}{name} {HELP[name]}')
+            lines.append(f'# TYPE {PREFIX}{name} histogram')
+            for labels, (counts, total, buckets) in series:
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}{name}_bucket{self._labels(labels, (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{PREFIX}{name}_sum{self._labels(labels)} {total}')
+                lines.append(f'{PREFIX}{name}_count{self._labels(labels)} {cumulative}')
+        for name, description in (('requests_sampled_total', "Sampled requests by status class"),
+                                  ('response_cache_total', "Response cache lookups of sampled requests")):
+            series = sorted((labels, value) for (metric, labels), value in counters.items() if metric == name)
+            if not series:
+                continue
+            lines.append(f'# HELP {PREFIX}{name} {description}')
+            lines.append(f'# TYPE {PREFIX}{name} counter')
+            for labels, value in series:
+                lines.append(f'{PREFIX}{name}{self._labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics_registry = MetricsRegistry()
+
+
+def view_name(view_func):
+    cls = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if cls is not None:
+        return cls.__name__
+    return getattr(view_func, '__name__', 'unknown')
+
+
+def server_timing(metrics, duration):
+    entries = [
+        f'db;dur={metrics.db_time * 1000:.2f};desc="{metrics.queries} queries"',
+        f'serializer;dur={metrics.serializer_time * 1000:.2f}',
+    ]
+    if metrics.cache is not None:
+        entries.append(f'cache;desc="{metrics.cache}"')
+    entries.append(f'total;dur={duration * 1000:.2f}')
+    return ', '.join(entries)
+
+
+class PerformanceMiddleware:
+    """
+    Measures a sample of the requests and adds a ``Server-Timing`` header to their responses.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'CORPMART_METRICS_SAMPLE_RATE', 0.1)
+        if sample_rate <= 0 or (sample_rate < 1 and random.random() >= sample_rate):
+            return self.get_response(request)
+
+        metrics = _current.metrics = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _current.metrics = None
+        duration = time.perf_counter() - start
+
+        size = None if response.streaming else len(response.content)
+        labels = (('view', metrics.view or 'unresolved'), ('method', request.method))
+        metrics_registry.observe(labels, metrics, duration, size, response.status_code)
+        response['Server-Timing'] = server_timing(metrics, duration)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.view = view_name(view_func)
+
+
+class InstrumentedViewMixin:
+    """
+    Adds serializer time to the metrics of sampled requests. The top level serializer's
+    ``to_representation`` is timed, which covers nested and list serializers under it. Views that
+    build their output without ``get_serializer`` time it with ``timed_serialization``.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if current_metrics() is not None:
+            to_representation = serializer.to_representation
+
+            def timed_to_representation(instance):
+                with timed_serialization():
+                    return to_representation(instance)
+
+            serializer.to_representation = timed_to_representation
+        return serializer
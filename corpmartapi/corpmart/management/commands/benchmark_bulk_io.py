@@ -0,0 +1,47 @@
+import csv
+import os
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...benchmarks.synthetic import benchmark_user, make_businesses
+from .import_businesses import BUSINESS_COLUMNS
+
+
+class Command(BaseCommand):
+    help = "Rows per second of import_businesses and export_businesses on a synthetic CSV. " \
+           "Everything is rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--businesses', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = options['businesses']
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'businesses.csv')
+            target = os.path.join(directory, 'export.csv')
+
+            with transaction.atomic():
+                posted_by = benchmark_user()
+                with open(source, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(BUSINESS_COLUMNS)
+                    for business in make_businesses(count, posted_by):
+                        writer.writerow([getattr(business, column) for column in BUSINESS_COLUMNS])
+
+                with open(os.devnull, 'w') as devnull:
+                    start = time.perf_counter()
+                    call_command('import_businesses', source, batch_size=options['batch_size'], stdout=devnull)
+                    imported = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    call_command('export_businesses', output=target, stdout=devnull)
+                    exported = time.perf_counter() - start
+                transaction.set_rollback(True)
+
+        self.stdout.write(f"import: {count / imported:10.0f} rows/s ({imported:.1f} s)")
+        self.stdout.write(f"export: {count / exported:10.0f} rows/s ({exported:.1f} s)")
@@ -0,0 +1,54 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from ...benchmarks.synthetic import seed_businesses
+from ...cards import CardCache, CardJSONRenderer
+from ...models import BusinessListing
+from ...serializers import BusinessListingSerializer
+
+
+class Command(BaseCommand):
+    help = "Time to serialize and render business cards per 1000 rows, with the serializer and from the " \
+           "card cache. The listings are loaded up front so no database time is included. The synthetic " \
+           "rows are rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def timed(self, repeat, func, setup=None):
+        timings = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = seed_businesses(options['rows'])
+            listings = list(BusinessListing.objects.filter(id__in=user.businesses.values('id'))
+                            .order_by('id')[:options['rows']])
+            transaction.set_rollback(True)
+
+        cache = CardCache(maxsize=len(listings))
+        renderer, card_renderer = JSONRenderer(), CardJSONRenderer()
+        per_thousand = 1000 / max(len(listings), 1)
+        results = {
+            'serializer': self.timed(options['repeat'], lambda: renderer.render(
+                BusinessListingSerializer(listings, many=True).data)),
+            'card cache, cold': self.timed(options['repeat'], lambda: card_renderer.render(
+                cache.cards_for_listings(listings, BusinessListingSerializer)), setup=cache.clear),
+            'card cache, warm': self.timed(options['repeat'], lambda: card_renderer.render(
+                cache.cards_for_listings(listings, BusinessListingSerializer))),
+        }
+
+        self.stdout.write(f"{len(listings)} cards, median of {options['repeat']} runs, per 1000 rows:")
+        for name, median in results.items():
+            self.stdout.write(f"{name:>18}: {median * per_thousand:8.2f} ms")
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from rest_framework.test import APIRequestFactory
+
+from ...benchmarks.synthetic import seed_businesses
+from ...facets import FACETS, facet_index
+from ...models import Business
+from ...response_cache import response_cache
+from ...views import BusinessListViewset
+
+
+class Command(BaseCommand):
+    help = "Compares the business list with and without facet counts on a synthetic table. " \
+           "The synthetic rows are rolled back afterwards."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--businesses', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def timed(self, repeat, func, setup=None):
+        timings = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        view = BusinessListViewset.as_view({'get': 'list'})
+
+        def list_businesses(params):
+            response = view(factory.get('/businesses/', params))
+            response.render()
+
+        def skip_response_cache():
+            # the list is served from response_cache after the first call, time the facet computation
+            response_cache.invalidate('business')
+
+        def grouped_queries():
+            # what the facet counts would cost as one grouped aggregate per facet
+            verified = Business.objects.filter(is_verified=True, state='Maharashtra')
+            for field in FACETS[:4]:
+                list(verified.values(field).annotate(count=Count('id')))
+
+        with transaction.atomic():
+            self.stdout.write(f"Seeding {options['businesses']} businesses")
+            seed_businesses(options['businesses'])
+            facet_index.rebuild()
+
+            params = {'state': 'Maharashtra', 'sort_by': '4'}
+            results = {
+                'list': self.timed(options['repeat'], lambda: list_businesses(params), skip_response_cache),
+                'list with facets': self.timed(options['repeat'], lambda: list_businesses(dict(params, facets='all')),
+                                               skip_response_cache),
+                'grouped aggregate queries': self.timed(options['repeat'], grouped_queries),
+            }
+            transaction.set_rollback(True)
+        facet_index.invalidate()
+        response_cache.invalidate('business')
+
+        for name, median in results.items():
+            self.stdout.write(f"{name:>28}: {median:8.2f} ms")
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from ...benchmarks.synthetic import benchmark_user
+from ...tokens import token_profiles
+from ...views import ValidateTokenView
+
+
+class FullAuthenticationView(APIView):
+    """
+    ValidateTokenView as it was before the token profile cache.
+    """
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request,):
+        user = request.user
+        return Response({"first_name": user.first_name, "last_name": user.last_name, "email": user.email,
+                         "mobile": user.mobile, "organisation_name": user.organisation_name}, )
+
+
+class Command(BaseCommand):
+    help = "Requests per second of token validation with full authentication and with the profile cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+
+    def throughput(self, view, key, count):
+        factory = APIRequestFactory()
+        start = time.perf_counter()
+        for _ in range(count):
+            response = view(factory.get('/validate-token/', HTTP_AUTHORIZATION=f'Token {key}'))
+            response.render()
+            assert response.status_code == 200, response.status_code
+        return count / (time.perf_counter() - start)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            token, created = Token.objects.get_or_create(user=benchmark_user())
+            before = self.throughput(FullAuthenticationView.as_view(), token.key, options['requests'])
+            after = self.throughput(ValidateTokenView.as_view(), token.key, options['requests'])
+            token_profiles.invalidate_token(token.key)
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"full authentication: {before:10.1f} requests/s")
+        self.stdout.write(f"      profile cache: {after:10.1f} requests/s")
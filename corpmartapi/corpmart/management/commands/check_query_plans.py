@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ...benchmarks.synthetic import benchmark_user, seed_businesses
+from ...models import Business, ContactRequest, ViewHistory
+from ...queryplans import CHECKED_TABLES, check_plans
+
+
+class Command(BaseCommand):
+    help = "EXPLAINs the queries behind the business, history and lead endpoints with sequential scans disabled " \
+           "and fails if any of them still reads the business, listing, contact request or view history table " \
+           "in full, meaning no index serves it, or if a keyset page doesn't start its index scan at the " \
+           "cursor. The tests run the same checks, --seed lets the planner pick between indexes at a realistic " \
+           "table size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Synthetic businesses to insert, rolled back after")
+
+    def seed(self, count):
+        user = seed_businesses(count)
+        business_ids = list(Business.objects.filter(posted_by=user).values_list('id', flat=True)[:count // 10])
+        ContactRequest.objects.bulk_create([ContactRequest(requested_by=user, business_id=business_id,
+                                                           processed=business_id % 5 != 0)
+                                            for business_id in business_ids], ignore_conflicts=True)
+        ViewHistory.objects.bulk_create([ViewHistory(viewed_by=user, business_id=business_id)
+                                         for business_id in business_ids], ignore_conflicts=True)
+        with connection.cursor() as cursor:
+            for table in CHECKED_TABLES:
+                cursor.execute(f'ANALYZE "{table}"')
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            for name, status, tables in check_plans(benchmark_user()):
+                self.stdout.write(f"{status:>13}  {name} {', '.join(tables)}")
+                if status != 'ok':
+                    failures.append(name)
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"Full or unbounded scans in: {', '.join(failures)}")
@@ -0,0 +1,45 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from ...models import Business
+from .import_businesses import BUSINESS_COLUMNS, file_format_of
+
+
+class Command(BaseCommand):
+    help = "Streams businesses out as CSV or JSONL, reading them in chunks so memory stays flat."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="File to write, standard output by default")
+        parser.add_argument('--format', choices=('csv', 'jsonl'))
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--verified-only', action='store_true')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or (file_format_of(options['output'], None) if options['output'] else 'csv')
+        queryset = Business.objects.order_by('id')
+        if options['verified_only']:
+            queryset = queryset.filter(is_verified=True)
+        columns = ['id'] + BUSINESS_COLUMNS
+        rows = queryset.values_list(*columns).iterator(chunk_size=options['chunk_size'])
+
+        f = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            exported = 0
+            if file_format == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                for row in rows:
+                    writer.writerow(row)
+                    exported += 1
+            else:
+                for row in rows:
+                    f.write(json.dumps(dict(zip(columns, row))) + '\n')
+                    exported += 1
+        finally:
+            if options['output']:
+                f.close()
+        if options['output']:
+            self.stdout.write(f"Exported {exported} businesses")
@@ -0,0 +1,112 @@
+import csv
+import json
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...models import Business, User
+from ...signals import businesses_changed_in_bulk
+
+
+# columns read by the importer and written by export_businesses
+BUSINESS_FIELDS = {field.attname: field for field in Business._meta.concrete_fields
+                   if field.attname not in ('id', 'search_vector')}
+BUSINESS_COLUMNS = list(BUSINESS_FIELDS)
+
+
+def read_rows(f, file_format):
+    if file_format == 'csv':
+        yield from csv.DictReader(f)
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def file_format_of(path, file_format):
+    if file_format:
+        return file_format
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.jsonl', '.json')):
+        return 'jsonl'
+    raise CommandError("Can't tell the format from the file name, pass --format")
+
+
+class Command(BaseCommand):
+    help = "Bulk imports businesses from a CSV or JSONL file with the columns of export_businesses. " \
+           "Rows are validated and inserted batch by batch, each batch in its own transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'))
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--posted-by', help="Email of the user rows without posted_by_id are posted by")
+
+    def clean(self, row, default_posted_by):
+        values = {}
+        for column, field in BUSINESS_FIELDS.items():
+            value = row.get(column)
+            if column == 'posted_by_id' and value in (None, ''):
+                value = default_posted_by
+            if value in (None, '') and (field.null or column not in row):
+                if field.has_default():
+                    continue
+                value = None if field.null else ''
+            if value is not None:
+                if field.is_relation:
+                    value = field.target_field.to_python(value)
+                else:
+                    # to_python doesn't check max_length and the like, the insert would fail the batch
+                    value = field.to_python(value)
+                    field.run_validators(value)
+                if field.choices and value not in self.choices[column]:
+                    raise ValidationError(f"{value!r} is not a valid {column}")
+            if value is None and not field.null:
+                raise ValidationError(f"{column} is required")
+            values[column] = value
+        return Business(**values)
+
+    def handle(self, *args, **options):
+        file_format = file_format_of(options['path'], options['format'])
+        default_posted_by = None
+        if options['posted_by']:
+            default_posted_by = User.objects.filter(email=options['posted_by']).values_list('id', flat=True).first()
+            if default_posted_by is None:
+                raise CommandError(f"No user with email {options['posted_by']}")
+        self.choices = {column: {value for value, _ in field.choices}
+                        for column, field in BUSINESS_FIELDS.items() if field.choices}
+
+        imported = 0
+        errors = 0
+        with open(options['path'], newline='', encoding='utf-8') as f:
+            rows = enumerate(read_rows(f, file_format), start=1)
+            while True:
+                batch = list(islice(rows, options['batch_size']))
+                if not batch:
+                    break
+                businesses = []
+                for number, row in batch:
+                    try:
+                        businesses.append(self.clean(row, default_posted_by))
+                    except (ValidationError, ValueError, TypeError) as e:
+                        errors += 1
+                        self.stderr.write(f"row {number}: {'; '.join(getattr(e, 'messages', [str(e)]))}")
+
+                # posted_by is checked once per batch
+                users = set(User.objects.filter(id__in={b.posted_by_id for b in businesses})
+                            .values_list('id', flat=True))
+                for business in [b for b in businesses if b.posted_by_id not in users]:
+                    errors += 1
+                    businesses.remove(business)
+                    self.stderr.write(f"unknown posted_by_id {business.posted_by_id}")
+
+                with transaction.atomic():
+                    created = Business.objects.bulk_create(businesses)
+                    businesses_changed_in_bulk([business.id for business in created])
+                imported += len(created)
+                self.stdout.write(f"{imported} imported", ending='\r')
+
+        self.stdout.write(f"Imported {imported} businesses, skipped {errors} rows")
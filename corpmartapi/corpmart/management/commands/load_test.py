@@ -0,0 +1,76 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...benchmarks.load import LoadRunner, default_scenarios, verified_business_ids
+from ...benchmarks.synthetic import benchmark_user, seed_blogs, seed_businesses
+from ...models import Blog, Business, ContactRequest, ViewHistory
+from ...view_history import view_history_recorder
+
+
+class Command(BaseCommand):
+    help = "Drives the business list, detail, max value, blog, post business and contact request endpoints " \
+           "with concurrent in-process clients and prints latency percentiles, queries per request and " \
+           "throughput as JSON. The synthetic dataset is committed so it can be reused between runs; " \
+           "use a local database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--businesses', type=int, default=10000,
+                            help="Synthetic businesses the dataset should hold (10k to 1M)")
+        parser.add_argument('--blogs', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+        parser.add_argument('--drop-dataset', action='store_true',
+                            help="Delete the synthetic businesses and blogs after the run")
+
+    def ensure_dataset(self, user, businesses, blogs, seed):
+        existing = Business.objects.filter(posted_by=user).count()
+        if existing < businesses:
+            self.stderr.write(f"Seeding {businesses - existing} businesses")
+            seed_businesses(businesses - existing, seed=seed + existing)
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE "{Business._meta.db_table}"')
+        existing = Blog.objects.filter(posted_by=user.email).count()
+        if existing < blogs:
+            seed_blogs(blogs - existing, seed=seed + existing)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--requests and --concurrency must be positive")
+
+        user = benchmark_user()
+        self.ensure_dataset(user, options['businesses'], options['blogs'], options['seed'])
+        last_id = Business.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        business_ids = verified_business_ids(seed=options['seed'])
+        if not business_ids:
+            raise CommandError("No verified businesses to request")
+
+        runner = LoadRunner(default_scenarios(business_ids), user, options['concurrency'], options['seed'])
+        try:
+            results = runner.run(options['requests'])
+        finally:
+            # writes made by the run, so the next run starts from the same dataset. Detail views are
+            # buffered by the recorder, write them first or they'd land after the cleanup.
+            view_history_recorder.flush()
+            Business.objects.filter(posted_by=user, id__gt=last_id).delete()
+            ContactRequest.objects.filter(requested_by=user).delete()
+            ViewHistory.objects.filter(viewed_by=user).delete()
+            if options['drop_dataset']:
+                Business.objects.filter(posted_by=user).delete()
+                Blog.objects.filter(posted_by=user.email).delete()
+
+        report = {
+            'config': {key: options[key] for key in ('businesses', 'blogs', 'requests', 'concurrency', 'seed')},
+            'environment': {'python': platform.python_version(), 'database': connection.vendor},
+            **results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from ...otp import otp_service
+
+
+class Command(BaseCommand):
+    help = "Deletes expired one time passwords."
+
+    def handle(self, *args, **options):
+        deleted = otp_service.purge_expired()
+        self.stdout.write(f"Deleted {deleted} expired one time passwords")
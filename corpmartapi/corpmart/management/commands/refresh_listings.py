@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import BusinessListing
+from ...signals import listings_changed_in_bulk
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the business listing read model from the business and balancesheet tables, " \
+           "e.g. after writes made directly in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('business_ids', nargs='*', type=int, help="Only refresh these businesses")
+
+    def handle(self, *args, **options):
+        business_ids = options['business_ids'] or None
+        with transaction.atomic():
+            deleted, written = BusinessListing.objects.refresh(business_ids)
+            listings_changed_in_bulk()
+        self.stdout.write(f"Wrote {written} and deleted {deleted} listings")
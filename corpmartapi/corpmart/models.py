@@ -1,7 +1,10 @@
 from django.conf import settings
-from django.db import models
+from django.db import connection, models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.base_user import BaseUserManager
+from django.utils import timezone
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.utils.translation import ugettext_lazy as _
 from datetime import datetime
 
@@ -70,11 +73,44 @@ class User(AbstractUser):
 
 class OneTimePassword(models.Model):
     otp = models.IntegerField()
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name="onetimepassword", on_delete=models.CASCADE)
+    # one current code per user, see otp.OTPService
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, related_name="onetimepassword", on_delete=models.CASCADE)
     updated_at = models.DateTimeField(auto_now=True)
 
 
+class BusinessQuerySet(models.QuerySet):
+
+    def update_search_vector(self):
+        """
+        Recomputes the stored search vector of every business in the queryset with one UPDATE.
+        """
+        return self.update(search_vector=(
+            SearchVector('business_name', weight='A') +
+            SearchVector('sale_description', 'industry', weight='B') +
+            SearchVector('company_type_others_description', 'sub_type_others_description',
+                         'industries_others_description', weight='C')
+        ))
+
+    def with_balancesheet_id(self):
+        """
+        Annotates ``balancesheet_pk``, the id of the business' balancesheet or None, through a join.
+        """
+        return self.annotate(balancesheet_pk=models.F('balancesheets__id'))
+
+    def with_contacted(self, user):
+        """
+        Annotates ``contacted``, whether ``user`` has already sent a contact request for the business.
+        """
+        return self.annotate(contacted=models.Exists(
+            ContactRequest.objects.filter(requested_by=user, business=models.OuterRef('pk'))
+        ))
+
+
 class Business(models.Model):
+    # fields that make up search_vector
+    SEARCH_FIELDS = ('business_name', 'sale_description', 'industry', 'company_type_others_description',
+                     'sub_type_others_description', 'industries_others_description')
+
     STATE_LIST = (("Andhra Pradesh","Andhra Pradesh"),
                   ("Arunachal Pradesh","Arunachal Pradesh"),
                   ("Assam","Assam"),("Bihar","Bihar"),
@@ -195,12 +231,28 @@ class Business(models.Model):
     paidup_capital = models.IntegerField(null=True, blank=True)
     user_defined_selling_price = models.IntegerField(null=True, blank=True)
     admin_defined_selling_price = models.IntegerField(null=True, blank=True)
+    # maintained by the post_save signal, see BusinessQuerySet.update_search_vector
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BusinessQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # remember what was loaded so signal receivers can tell what a save changed
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
 
     def __str__(self):
         return f"ID: {self.id} | NAME: {self.business_name}"
 
     class Meta:
         verbose_name_plural = 'Businesses'
+        indexes = [
+            GinIndex(fields=['search_vector'], name='business_search_vector_gin'),
+            # the admin's verification queue
+            models.Index(fields=['id'], name='business_unverified_idx', condition=models.Q(is_verified=False)),
+        ]
 
 
 class Balancesheet(models.Model):
@@ -212,6 +264,112 @@ class Balancesheet(models.Model):
         return f"Business: {self.business}"
 
 
+class CurrentTransactionId(models.Func):
+    """
+    ``txid_current()``, the 64 bit id of the running transaction, used as the listing version.
+    """
+    function = 'txid_current'
+    template = '%(function)s()'
+    output_field = models.BigIntegerField()
+
+
+class BusinessListingQuerySet(models.QuerySet):
+
+    def refresh(self, business_ids=None):
+        """
+        Brings the listings of ``business_ids`` (all businesses when None) in line with the business and
+        balancesheet tables: one DELETE for listings no longer verified, one upsert for the rest.
+        Rows whose values haven't changed are left alone. Returns the number of deleted and written rows.
+        """
+        listing = self.model._meta.db_table
+        business = Business._meta.db_table
+        balancesheet = Balancesheet._meta.db_table
+        copied = ', '.join(f'"{field}"' for field in BusinessListing.COPIED_FIELDS)
+        selected = ', '.join(f'b."{field}"' for field in BusinessListing.COPIED_FIELDS)
+        updated = BusinessListing.COPIED_FIELDS + ('has_balancesheet',)
+        assignments = ', '.join(f'"{field}" = EXCLUDED."{field}"' for field in updated)
+        current = ', '.join(f'"{listing}"."{field}"' for field in updated)
+        excluded = ', '.join(f'EXCLUDED."{field}"' for field in updated)
+        params = []
+        delete_filter = insert_filter = ''
+        if business_ids is not None:
+            params = [list(business_ids)]
+            delete_filter = f'AND "{listing}"."id" = ANY(%s)'
+            insert_filter = 'AND b."id" = ANY(%s)'
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                DELETE FROM "{listing}"
+                WHERE NOT EXISTS (SELECT 1 FROM "{business}" b WHERE b."id" = "{listing}"."id" AND b."is_verified")
+                {delete_filter}
+            ''', params)
+            deleted = cursor.rowcount
+            cursor.execute(f'''
+                INSERT INTO "{listing}" ("id", {copied}, "has_balancesheet", "version")
+                SELECT b."id", {selected}, EXISTS (SELECT 1 FROM "{balancesheet}" s WHERE s."business_id" = b."id"),
+                    txid_current()
+                FROM "{business}" b
+                WHERE b."is_verified" {insert_filter}
+                ON CONFLICT ("id") DO UPDATE SET {assignments}, "version" = EXCLUDED."version"
+                WHERE ({current}) IS DISTINCT FROM ({excluded})
+            ''', params)
+            return deleted, cursor.rowcount
+
+
+class BusinessListing(models.Model):
+    """
+    Narrow copy of the verified businesses holding only what the public business list shows, filters
+    and sorts on, with the balancesheet join folded into ``has_balancesheet``. ``id`` is the business
+    id. Kept in sync by the receivers in signals.py; ``BusinessListing.objects.refresh()`` rebuilds it.
+    """
+    # Business fields copied as they are
+    COPIED_FIELDS = ('sale_description', 'company_type', 'sub_type', 'sub_type_others_description', 'industry',
+                     'industries_others_description', 'state', 'country', 'year_of_incorporation',
+                     'has_gst_number', 'has_import_export_code', 'has_bank_account', 'has_other_license',
+                     'authorised_capital', 'paidup_capital', 'admin_defined_selling_price')
+
+    id = models.IntegerField(primary_key=True)
+    sale_description = models.CharField(max_length=500, blank=True)
+    company_type = models.CharField(max_length=200, choices=Business.COMPANY_TYPE_LIST, null=True, blank=True)
+    sub_type = models.CharField(max_length=200, choices=Business.SUB_TYPE_LIST, null=True, blank=True)
+    sub_type_others_description = models.CharField(max_length=500, blank=True, null=True)
+    industry = models.CharField(max_length=200, choices=Business.INDUSTRY_LIST, null=True, blank=True)
+    industries_others_description = models.CharField(max_length=500, blank=True, null=True)
+    state = models.CharField(max_length=100, choices=Business.STATE_LIST, null=True, blank=True)
+    country = models.CharField(max_length=100, default='India')
+    year_of_incorporation = models.IntegerField(null=True, blank=True)
+    has_gst_number = models.BooleanField(null=True)
+    has_import_export_code = models.BooleanField(null=True)
+    has_bank_account = models.BooleanField(null=True)
+    has_other_license = models.BooleanField(null=True)
+    authorised_capital = models.IntegerField(null=True, blank=True)
+    paidup_capital = models.IntegerField(null=True, blank=True)
+    admin_defined_selling_price = models.IntegerField(null=True, blank=True)
+    has_balancesheet = models.BooleanField(default=False)
+    # id of the transaction that last wrote the row, see cards.CardCache. Transaction ids are never
+    # reused, so a listing deleted and inserted again doesn't get a version it had before.
+    version = models.BigIntegerField(default=0, editable=False)
+
+    objects = BusinessListingQuerySet.as_manager()
+
+    def __str__(self):
+        return f"ID: {self.id}"
+
+    class Meta:
+        indexes = [
+            # (sort field, id) for the keyset paginated business list, see BusinessCursorPagination,
+            # and the min/max of BusinessBounds
+            models.Index(fields=['year_of_incorporation', 'id'], name='listing_year_id_idx'),
+            models.Index(fields=['authorised_capital', 'id'], name='listing_auth_capital_id_idx'),
+            models.Index(fields=['paidup_capital', 'id'], name='listing_paidup_capital_id_idx'),
+            models.Index(fields=['admin_defined_selling_price', 'id'], name='listing_price_id_idx'),
+            models.Index(fields=['state', 'id'], name='listing_state_id_idx'),
+            models.Index(fields=['industry', 'id'], name='listing_industry_id_idx'),
+            models.Index(fields=['company_type', 'id'], name='listing_company_type_id_idx'),
+            models.Index(fields=['sub_type', 'id'], name='listing_sub_type_id_idx'),
+        ]
+
+
 # Model to keep track of balancesheet orders
 # class BalancesheetPayment(models.Model):
 #     # transaction_id will be created each time "buy" button is pressed
@@ -233,6 +391,8 @@ class Blog(models.Model):
     blog_title = models.CharField(max_length=200)
     blog_text = models.CharField(max_length=10000)
     picture = models.ImageField(upload_to='blog_picture', blank=True)
+    # name of the picture whose resized derivatives have been generated, see images.srcset
+    picture_derivatives = models.CharField(max_length=100, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     posted_by = models.CharField(max_length=100)
@@ -246,6 +406,8 @@ class Testimonial(models.Model):
     designation = models.CharField(max_length=200)
     text = models.CharField(max_length=500)
     picture = models.ImageField(upload_to='profile_picture', blank=True)
+    # name of the picture whose resized derivatives have been generated, see images.srcset
+    picture_derivatives = models.CharField(max_length=100, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -264,6 +426,12 @@ class ContactRequest(models.Model):
 
     class Meta:
         unique_together = ("requested_by", "business")
+        indexes = [
+            # open leads in the admin and the lead export
+            models.Index(fields=['created_at'], name='contactrequest_open_idx', condition=models.Q(processed=False)),
+            # a user's requests, newest first, on the dashboard
+            models.Index(fields=['requested_by', '-created_at'], name='contactrequest_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"Requested by -> {self.requested_by} || Business -> {self.business}"
@@ -272,10 +440,16 @@ class ContactRequest(models.Model):
 class ViewHistory(models.Model):
     business = models.ForeignKey(Business, related_name='viewhistory', on_delete=models.CASCADE)
     viewed_by = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='viewhistory', on_delete=models.CASCADE)
-    viewed_at = models.DateTimeField(auto_now_add=True)
+    # set when the view happened rather than when the buffered row was written, see ViewHistoryRecorder
+    viewed_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         verbose_name_plural = 'ViewHistory'
+        unique_together = ("business", "viewed_by")
+        indexes = [
+            # a user's history, most recent first
+            models.Index(fields=['viewed_by', '-viewed_at'], name='viewhistory_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"Viewed by -> {self.viewed_by} || Business -> {self.business}"
@@ -0,0 +1,212 @@
+"""
+Background delivery of admin notifications by email and sms.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections
+
+from .models import ChatbotNotification
+
+
+logger = logging.getLogger(__name__)
+
+
+class Email:
+    def __init__(self, subject, body, recipients):
+        self.subject = subject
+        self.body = body
+        self.recipients = recipients
+
+
+class Sms:
+    def __init__(self, mobile, message):
+        self.mobile = mobile
+        self.message = message
+
+
+class ChatbotRequestNotification:
+    """
+    Expands into one email and one sms per ``ChatbotNotification`` recipient once it reaches a worker.
+    """
+    def __init__(self, name, mobile, email, query):
+        self.name = name
+        self.mobile = mobile
+        self.email = email
+        self.query = query
+
+    def expand(self):
+        subject = f"New chatbot request from {self.name}"
+        body = f"Name: {self.name}\nMobile: {self.mobile}\nEmail: {self.email}\n\n{self.query}"
+        jobs = []
+        for admin in ChatbotNotification.objects.all():
+            if admin.email:
+                jobs.append(Email(subject, body, [admin.email]))
+            if admin.mobile:
+                jobs.append(Sms(admin.mobile, f"{subject}, mobile {self.mobile}"))
+        return jobs
+
+
+class NotificationDispatcher:
+    """
+    Queue of notification jobs drained by a small pool of daemon threads. Each worker takes whatever
+    is queued up to ``batch_size`` jobs, sends all of the emails over one SMTP connection and the sms
+    through a shared ``requests.Session``, retrying failed deliveries up to ``retries`` times with
+    exponential backoff. Only the messages that failed are retried. Whatever is still queued when the
+    process exits is delivered by ``drain``.
+    """
+    def __init__(self, workers=None, batch_size=None, retries=None, backoff=None):
+        self.workers = workers or getattr(settings, 'CORPMART_NOTIFICATION_WORKERS', 2)
+        self.batch_size = batch_size or getattr(settings, 'CORPMART_NOTIFICATION_BATCH_SIZE', 50)
+        self.retries = retries if retries is not None else getattr(settings, 'CORPMART_NOTIFICATION_RETRIES', 3)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'CORPMART_NOTIFICATION_BACKOFF', 1)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def enqueue(self, job):
+        if not getattr(settings, 'CORPMART_NOTIFICATIONS_ASYNC', True):
+            self.deliver([job])
+            return
+        with self._lock:
+            if not self._threads:
+                for number in range(self.workers):
+                    thread = threading.Thread(target=self._run, name=f'notifications-{number}', daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+                atexit.register(self.drain)
+        self._queue.put(job)
+
+    def notify_chatbot_request(self, chatbot_request):
+        self.enqueue(ChatbotRequestNotification(chatbot_request.name, chatbot_request.mobile,
+                                                chatbot_request.email, chatbot_request.query))
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self._deliver_batch(jobs)
+
+    def _deliver_batch(self, jobs):
+        try:
+            self.deliver(jobs)
+        except Exception:
+            logger.exception("Failed to deliver %d notifications", len(jobs))
+        finally:
+            for _ in jobs:
+                self._queue.task_done()
+
+    def drain(self):
+        """
+        Delivers the queued jobs from the calling thread and waits for the batches the workers are on.
+        """
+        while True:
+            jobs = []
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not jobs:
+                break
+            self._deliver_batch(jobs)
+        self._queue.join()
+
+    def deliver(self, jobs):
+        emails, sms = [], []
+        pending = list(jobs)
+        while pending:
+            job = pending.pop()
+            if isinstance(job, Email):
+                emails.append(job)
+            elif isinstance(job, Sms):
+                sms.append(job)
+            else:
+                pending.extend(job.expand())
+        for email in self.deliver_emails(emails):
+            logger.error("Failed to send email to %s", ", ".join(email.recipients))
+        for message in sms:
+            try:
+                self.with_retries(self.send_sms, message)
+            except Exception:
+                logger.exception("Failed to send sms to %s", message.mobile)
+
+    def with_retries(self, func, *args):
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def deliver_emails(self, emails):
+        """
+        Sends ``emails``, retrying the ones that failed. Returns those that failed every attempt.
+        """
+        for attempt in range(self.retries + 1):
+            if not emails:
+                break
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                emails = self.send_emails(emails)
+            except Exception:
+                # the connection couldn't be opened, nothing was sent
+                logger.warning("Failed to connect to send %d emails", len(emails), exc_info=True)
+        return emails
+
+    @staticmethod
+    def send_emails(emails):
+        """
+        Sends ``emails`` over one connection, one message at a time so a failure doesn't hide which
+        messages went out. Returns the ones that failed.
+        """
+        failed = []
+        connection = get_connection(fail_silently=False)
+        connection.open()
+        try:
+            for email in emails:
+                message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, email.recipients,
+                                       connection=connection)
+                try:
+                    connection.send_messages([message])
+                except Exception:
+                    logger.warning("Failed to send email to %s", ", ".join(email.recipients), exc_info=True)
+                    failed.append(email)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                logger.warning("Failed to close the email connection", exc_info=True)
+        return failed
+
+    def send_sms(self, message):
+        url = getattr(settings, 'CORPMART_SMS_GATEWAY_URL', None)
+        if not url:
+            return
+        payload = dict(getattr(settings, 'CORPMART_SMS_GATEWAY_PARAMS', {}), to=message.mobile,
+                       message=message.message)
+        response = self.session.post(url, data=payload, timeout=10)
+        response.raise_for_status()
+
+
+notification_dispatcher = NotificationDispatcher()
@@ -0,0 +1,122 @@
+"""
+One time password issuance and verification for mobile login.
+"""
+import secrets
+import threading
+import time
+from datetime import timedelta
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import User, OneTimePassword
+from .notifications import Sms, notification_dispatcher
+
+
+class RateLimited(Exception):
+
+    def __init__(self, wait):
+        super().__init__(wait)
+        self.wait = wait
+
+
+class TokenBucket:
+    """
+    In-memory token buckets, ``capacity`` tokens per key refilled over ``period`` seconds.
+    """
+    def __init__(self, capacity, period, maxsize=100000):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._buckets = TTLCache(maxsize, period)
+        self._lock = threading.Lock()
+
+    def consume(self, key):
+        """
+        Takes a token for ``key``, raising ``RateLimited`` with the seconds until the next one if empty.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                raise RateLimited((1 - tokens) / self.rate)
+            self._buckets[key] = (tokens - 1, now)
+
+
+class OTPService:
+    """
+    Issues and verifies login codes. The ``OneTimePassword`` row (one per user, overwritten on every
+    issue) is the only copy of a code, so the latest code wins and a code works once whichever
+    instance handles the requests.
+    """
+    def __init__(self):
+        self.ttl = getattr(settings, 'CORPMART_OTP_TTL', 300)
+        self.issue_per_mobile = TokenBucket(*getattr(settings, 'CORPMART_OTP_ISSUE_PER_MOBILE', (3, 600)))
+        self.issue_per_ip = TokenBucket(*getattr(settings, 'CORPMART_OTP_ISSUE_PER_IP', (20, 600)))
+        self.verify_per_mobile = TokenBucket(*getattr(settings, 'CORPMART_OTP_VERIFY_PER_MOBILE', (5, 600)))
+        self.purge_interval = getattr(settings, 'CORPMART_OTP_PURGE_INTERVAL', 3600)
+        self._purged_at = None
+
+    @staticmethod
+    def store(user_id, otp):
+        """
+        Replaces the user's code. ``OneTimePassword.user`` is unique, so when two issues race to create
+        the row the loser overwrites the winner's code instead.
+        """
+        now = timezone.now()
+        codes = OneTimePassword.objects.filter(user_id=user_id)
+        if codes.update(otp=otp, updated_at=now):
+            return
+        try:
+            with transaction.atomic():
+                OneTimePassword.objects.create(user_id=user_id, otp=otp)
+        except IntegrityError:
+            codes.update(otp=otp, updated_at=now)
+
+    def issue(self, mobile, ip):
+        """
+        Sends a new code to ``mobile``. Raises ``User.DoesNotExist`` for unknown numbers.
+        """
+        self.issue_per_ip.consume(ip)
+        self.issue_per_mobile.consume(mobile)
+        user_id = User.objects.filter(mobile=mobile).values_list('id', flat=True).get()
+
+        otp = 100000 + secrets.randbelow(900000)
+        self.store(user_id, otp)
+
+        notification_dispatcher.enqueue(Sms(mobile, f"{otp} is your CorpMart verification code"))
+        self.purge_if_due()
+
+    def verify(self, mobile, otp):
+        """
+        Returns the user id if ``otp`` is the current code for ``mobile``, None otherwise. The code is
+        consumed by deleting its row on the condition that it still holds this code, so of two
+        concurrent verifications only the one that deleted the row succeeds.
+        """
+        self.verify_per_mobile.consume(mobile)
+        if not str(otp).isdigit():
+            return None
+        user_id = User.objects.filter(mobile=mobile).values_list('id', flat=True).first()
+        if user_id is None:
+            return None
+        deleted, _ = OneTimePassword.objects.filter(
+            user_id=user_id, otp=int(otp), updated_at__gte=timezone.now() - timedelta(seconds=self.ttl)
+        ).delete()
+        return user_id if deleted == 1 else None
+
+    def purge_expired(self):
+        """
+        Deletes every expired code with one query.
+        """
+        self._purged_at = time.monotonic()
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        return OneTimePassword.objects.filter(updated_at__lt=cutoff).delete()[0]
+
+    def purge_if_due(self):
+        if self._purged_at is None or time.monotonic() - self._purged_at > self.purge_interval:
+            self.purge_expired()
+
+
+otp_service = OTPService()
@@ -0,0 +1,127 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from .facets import SORT_OPTIONS
+
+
+class BusinessCursorPagination(BasePagination):
+    """
+    Keyset pagination over the business list for every sort_by option. Pages are ordered by
+    (sort field, id) and each cursor carries the last pair seen, so a page is one index range scan
+    no matter how deep it is and listings verified in the meantime don't shift the pages.
+    Searches are ordered by id instead of rank in this mode.
+    """
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    @staticmethod
+    def get_sort(request):
+        return SORT_OPTIONS.get(request.query_params.get('sort_by'), ('id', False))
+
+    def encode_cursor(self, value, pk):
+        return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(pk, int) or not (value is None or isinstance(value, int)):
+                raise ValueError
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    @staticmethod
+    def segments(field, descending, cursor):
+        """
+        Conditions selecting the rows after ``cursor`` (a (value, pk) pair or None), as consecutive
+        segments of the (field, id) order to be read one after the other. Postgres puts nulls last in
+        ascending and first in descending order, which is also how the (field, id) indexes are scanned.
+        Each condition bounds the field on the cursor's side so the index scan starts at the cursor
+        instead of filtering its way there, the null rows are a segment of their own.
+        """
+        if cursor is None:
+            return [Q()]
+        value, pk = cursor
+        if field == 'id':
+            return [Q(id__lt=pk) if descending else Q(id__gt=pk)]
+        if descending:
+            if value is None:
+                return [Q(**{f'{field}__isnull': True, 'id__lt': pk}), Q(**{f'{field}__isnull': False})]
+            return [Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk}))]
+        if value is None:
+            return [Q(**{f'{field}__isnull': True, 'id__gt': pk})]
+        return [Q(**{f'{field}__gte': value}) & (Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})),
+                Q(**{f'{field}__isnull': True})]
+
+    @staticmethod
+    def order(queryset, field, descending):
+        if descending:
+            return queryset.order_by(F(field).desc(nulls_first=True), '-id')
+        return queryset.order_by(F(field).asc(nulls_last=True), 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        field, descending = self.get_sort(request)
+        page_size = self.get_page_size(request)
+
+        # one query per segment, later segments only when the earlier ones came back short
+        ordered = self.order(queryset, field, descending)
+        page = []
+        for condition in self.segments(field, descending, self.decode_cursor(request)):
+            page.extend(ordered.filter(condition)[:page_size + 1 - len(page)])
+            if len(page) > page_size:
+                break
+
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(getattr(page[-1], field), page[-1].id)
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        ]))
+
+
+class OptionalPageNumberPagination(PageNumberPagination):
+    """
+    Only paginates when the client asks for a page, so existing clients keep getting the full list.
+    """
+    page_size = api_settings.PAGE_SIZE or 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
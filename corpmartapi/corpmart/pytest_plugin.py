@@ -0,0 +1,29 @@
+"""
+pytest fixtures for the query checks, enable with ``pytest_plugins = ['corpmart.pytest_plugin']``.
+
+    def test_business_detail(client, query_budget):
+        with query_budget(3):
+            client.get('/business-detail/?business_id=1')
+"""
+import pytest
+
+from .querycheck import QueryDetector
+
+
+@pytest.fixture
+def query_budget(request):
+    """
+    Returns a ``QueryDetector`` factory that fails on N+1 by default. ``@pytest.mark.query_budget(n)``
+    sets the default budget for the test.
+    """
+    marker = request.node.get_closest_marker('query_budget')
+    default = marker.args[0] if marker else None
+
+    def detector(budget=default, **kwargs):
+        kwargs.setdefault('fail_on_repeats', True)
+        return QueryDetector(budget=budget, **kwargs)
+    return detector
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "query_budget(n): most queries a query_budget block may run")
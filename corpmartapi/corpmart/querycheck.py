@@ -0,0 +1,176 @@
+"""
+Development and CI helpers that watch the queries a block of code runs: repeated queries of the same
+shape (the usual N+1 from a serializer field or method), slow queries with their plan and a budget
+on the total.
+
+    with QueryDetector(budget=3):
+        client.get('/business-detail/?business_id=1')
+
+Set ``CORPMART_QUERY_DETECTOR = True`` (or run with ``DEBUG``) to log the findings of every request
+through ``QueryDetectorMiddleware``.
+"""
+import logging
+import os
+import re
+import time
+import traceback
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(sql):
+    """
+    The shape of a query: literals and placeholder lists collapsed, so the same query for another row
+    or another number of ids gets the same fingerprint.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def origin(stack=None):
+    """
+    Where in this app a query came from, as 'file:line in function'. A serializer frame is preferred
+    since that is where per object queries usually hide.
+    """
+    frames = [frame for frame in (stack or traceback.extract_stack())
+              if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__]
+    if not frames:
+        return None
+    serializer_frames = [frame for frame in frames if os.path.basename(frame.filename) == 'serializers.py']
+    frame = (serializer_frames or frames)[-1]
+    return f"{os.path.relpath(frame.filename, PACKAGE_DIR)}:{frame.lineno} in {frame.name}"
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecord:
+    def __init__(self, alias, sql, params, duration, origin):
+        self.alias = alias
+        self.sql = sql
+        self.params = params
+        self.duration = duration
+        self.origin = origin
+        self.fingerprint = fingerprint(sql)
+        self.plan = None
+
+
+class QueryDetector:
+    """
+    Context manager recording the queries run on all connections while it is active.
+
+    ``budget``: the most queries allowed, exceeding it raises ``QueryBudgetExceeded`` on exit.
+    ``repeat_threshold``: how many queries of one shape count as N+1.
+    ``fail_on_repeats``: raise on N+1 as well, not only log it.
+    ``slow_ms``: queries at least this slow are logged with their EXPLAIN plan.
+    ``label``: prefix of the log messages.
+    """
+
+    def __init__(self, budget=None, repeat_threshold=None, fail_on_repeats=False, slow_ms=None, explain=True,
+                 label=''):
+        self.budget = budget
+        self.repeat_threshold = repeat_threshold or getattr(settings, 'CORPMART_QUERY_REPEAT_THRESHOLD', 5)
+        self.fail_on_repeats = fail_on_repeats
+        self.slow_ms = slow_ms if slow_ms is not None else getattr(settings, 'CORPMART_SLOW_QUERY_MS', 100)
+        self.explain = explain
+        self.label = label
+        self.queries = []
+        self._stack = None
+
+    def _wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration = (time.perf_counter() - start) * 1000
+                self.queries.append(QueryRecord(alias, sql, params, duration, origin()))
+        return record
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self._wrapper(connection.alias)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._stack.close()
+        if exc_type is not None:
+            return False
+        self.report()
+        problems = []
+        if self.budget is not None and len(self.queries) > self.budget:
+            problems.append(f"{len(self.queries)} queries, budget is {self.budget}")
+        if self.fail_on_repeats:
+            problems.extend(f"{len(records)} x {records[0].origin or 'unknown origin'}: {shape}"
+                            for shape, records in self.repeated().items())
+        if problems:
+            raise QueryBudgetExceeded("\n".join(problems + ["Queries:"] + [record.sql for record in self.queries]))
+        return False
+
+    def repeated(self):
+        """
+        Query shapes run at least ``repeat_threshold`` times, with their records.
+        """
+        by_shape = defaultdict(list)
+        for record in self.queries:
+            by_shape[record.fingerprint].append(record)
+        return {shape: records for shape, records in by_shape.items() if len(records) >= self.repeat_threshold}
+
+    def slow(self):
+        return [record for record in self.queries if record.duration >= self.slow_ms]
+
+    def explain_plan(self, record):
+        if not record.sql.lstrip().upper().startswith('SELECT'):
+            return None
+        try:
+            with connections[record.alias].cursor() as cursor:
+                cursor.execute(f'EXPLAIN {record.sql}', record.params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+        except DatabaseError as e:
+            return f"EXPLAIN failed: {e}"
+
+    def report(self):
+        label = self.label
+        for shape, records in self.repeated().items():
+            origins = sorted({record.origin or 'unknown origin' for record in records})
+            logger.warning("%sPossible N+1: %d queries from %s: %s", label, len(records), ", ".join(origins), shape)
+        for record in self.slow():
+            if self.explain and record.plan is None:
+                record.plan = self.explain_plan(record)
+            logger.warning("%sSlow query (%.1f ms) from %s: %s\n%s", label, record.duration,
+                           record.origin or 'unknown origin', record.sql, record.plan or '')
+
+
+class QueryDetectorMiddleware:
+    """
+    Logs the N+1 and slow queries of every request, for development. Does nothing unless
+    ``CORPMART_QUERY_DETECTOR`` (default: ``DEBUG``) is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'CORPMART_QUERY_DETECTOR', settings.DEBUG):
+            return self.get_response(request)
+        detector = QueryDetector(label=f"{request.method} {request.path}: ")
+        with detector:
+            response = self.get_response(request)
+        response['X-Query-Count'] = str(len(detector.queries))
+        return response
@@ -0,0 +1,109 @@
+"""
+EXPLAIN checks for the queries behind the business, history and lead endpoints, shared by the
+``check_query_plans`` command and the tests.
+
+Sequential scans are disabled while explaining, so a plan that still reads one of the checked tables
+in full, sequentially or through a whole index, has no index that can serve the query, whatever the
+size of the tables. Cursor pages must also start their index scan at the cursor instead of filtering
+their way there.
+"""
+import json
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .facets import SORT_OPTIONS
+from .models import Business, BusinessListing, ContactRequest, ViewHistory
+from .pagination import BusinessCursorPagination
+from .views import BusinessListViewset, BusinessDetailViewset, ViewHistoryViewset
+
+# tables that must never be read in full by the checked queries
+CHECKED_TABLES = (Business._meta.db_table, BusinessListing._meta.db_table, ContactRequest._meta.db_table,
+                  ViewHistory._meta.db_table)
+
+
+def view_queryset(viewset, params, user=None):
+    request = Request(APIRequestFactory().get('/', params))
+    request.user = user or AnonymousUser()
+    view = viewset(request=request, format_kwarg=None, kwargs={}, action='list')
+    return view.get_queryset()
+
+
+def business_list(params, page_size=20):
+    return view_queryset(BusinessListViewset, params)[:page_size]
+
+
+def business_cursor_page(sort_by, value, pk, page_size=20):
+    field, descending = SORT_OPTIONS[sort_by]
+    queryset = view_queryset(BusinessListViewset, {'sort_by': sort_by, 'cursor': ''})
+    condition = BusinessCursorPagination.segments(field, descending, (value, pk))[0]
+    return BusinessCursorPagination.order(queryset.filter(condition), field, descending)[:page_size]
+
+
+def checks(user):
+    """
+    The queries behind the listed endpoints, with representative parameters.
+    """
+    checks = [
+        ('business list by state', lambda: business_list({'state': 'Goa'})),
+        ('business list by industry', lambda: business_list({'industry': 'AVIATION'})),
+        ('business list by company type', lambda: business_list({'company_type': 'Others'})),
+        ('business list by sub type', lambda: business_list({'sub_type': 'Nidhi Company'})),
+        ('business search', lambda: business_list({'search': 'aviation'})),
+        ('business detail', lambda: view_queryset(BusinessDetailViewset, {'business_id': 1}, user)),
+        ('view history', lambda: view_queryset(ViewHistoryViewset, {}, user)[:20]),
+        ('open contact requests',
+         lambda: ContactRequest.objects.filter(processed=False).order_by('created_at')[:100]),
+        ('user contact requests',
+         lambda: ContactRequest.objects.filter(requested_by=user).order_by('-created_at')[:20]),
+    ]
+    for sort_by in SORT_OPTIONS:
+        checks.append((f'business cursor page sort_by={sort_by}',
+                       lambda sort_by=sort_by: business_cursor_page(sort_by, 1000000, 1)))
+    return checks
+
+
+def index_conditions(plan):
+    # a bitmap heap scan carries the condition of the bitmap index scans below it as its recheck condition
+    if plan.get('Relation Name') in CHECKED_TABLES and ('Index Cond' in plan or 'Recheck Cond' in plan):
+        yield plan.get('Index Cond', plan.get('Recheck Cond'))
+    for child in plan.get('Plans', ()):
+        yield from index_conditions(child)
+
+
+def full_scans(plan):
+    # with sequential scans off the planner filters its way through a whole index when none matches the
+    # condition, a partial index whose predicate is the condition is read without either
+    whole_index = plan.get('Node Type') in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in plan \
+        and 'Filter' in plan
+    if plan.get('Relation Name') in CHECKED_TABLES and (plan.get('Node Type') == 'Seq Scan' or whole_index):
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from full_scans(child)
+
+
+def explain(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def check_plans(user):
+    """
+    Yields ``(name, status, tables)`` for each check, the status being 'ok', 'FULL SCAN' or
+    'NO INDEX COND'. Has to run inside a transaction, the planner setting is local to it.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL enable_seqscan = off')
+    for name, build in checks(user):
+        plan = explain(build())
+        tables = sorted(set(full_scans(plan)))
+        # a keyset page has to start its index scan at the cursor, not filter its way there
+        unbounded = name.startswith('business cursor page') and not any(index_conditions(plan))
+        yield name, 'FULL SCAN' if tables else 'NO INDEX COND' if unbounded else 'ok', tables
@@ -0,0 +1,127 @@
+"""
+Cache for the serialized payloads of the public read only endpoints.
+"""
+import hashlib
+import threading
+from collections import Counter
+
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+from .instrumentation import record_cache_result
+
+
+# headers kept with a cached payload
+CACHED_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control')
+
+
+class ResponseCache:
+    """
+    Two tier cache of response data: a bounded LRU/TTL dict per process, optionally backed by the
+    django cache named by ``CORPMART_RESPONSE_CACHE_BACKEND`` so instances share their entries.
+    Entries are grouped in namespaces which are invalidated as a whole by bumping their version.
+    """
+    def __init__(self, maxsize=None, ttl=None):
+        self._local = TTLCache(maxsize or getattr(settings, 'CORPMART_RESPONSE_CACHE_SIZE', 1000),
+                               ttl or getattr(settings, 'CORPMART_RESPONSE_CACHE_TTL', 30))
+        self._versions = Counter()
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    @property
+    def backend(self):
+        alias = getattr(settings, 'CORPMART_RESPONSE_CACHE_BACKEND', None)
+        return caches[alias] if alias else None
+
+    @staticmethod
+    def _backend_version_key(namespace):
+        return f"corpmart:response-cache:{namespace}:version"
+
+    def _backend_key(self, namespace, key):
+        version = self.backend.get_or_set(self._backend_version_key(namespace), 1, None)
+        return f"corpmart:response-cache:{namespace}:{version}:{hashlib.md5(key.encode()).hexdigest()}"
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._local.get((namespace, self._versions[namespace], key))
+        if entry is not None:
+            self.counters['local_hits'] += 1
+            return entry
+        if self.backend is not None:
+            entry = self.backend.get(self._backend_key(namespace, key))
+            if entry is not None:
+                self.counters['backend_hits'] += 1
+                with self._lock:
+                    self._local[namespace, self._versions[namespace], key] = entry
+                return entry
+        self.counters['misses'] += 1
+        return None
+
+    def set(self, namespace, key, entry):
+        with self._lock:
+            self._local[namespace, self._versions[namespace], key] = entry
+        if self.backend is not None:
+            self.backend.set(self._backend_key(namespace, key), entry,
+                             getattr(settings, 'CORPMART_RESPONSE_CACHE_BACKEND_TTL', 300))
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._versions[namespace] += 1
+        if self.backend is not None:
+            version_key = self._backend_version_key(namespace)
+            try:
+                self.backend.incr(version_key)
+            except ValueError:
+                self.backend.add(version_key, 2, None)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._local)
+        return dict(self.counters, local_size=size)
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    """
+    Serves list and retrieve from ``response_cache``, keyed on the view, the url with its query string
+    normalized and the accepted renderer. Only for views whose responses don't depend on the user.
+    """
+    cache_namespace = None
+
+    def get_cache_key(self, request):
+        params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+        kwargs = sorted(self.kwargs.items())
+        return f"{type(self).__name__}:{getattr(self, 'action', None)}:{kwargs}:{request.accepted_renderer.format}:" \
+               f"{request.get_host()}{request.path}?{params}"
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        key = self.get_cache_key(request)
+        entry = response_cache.get(self.cache_namespace, key)
+        record_cache_result(entry is not None)
+        if entry is not None:
+            data, headers = entry
+            response = Response(data, headers=headers)
+            response['X-Cache'] = 'HIT'
+            last_modified = parse_http_date_safe(headers['Last-Modified']) if 'Last-Modified' in headers else None
+            return get_conditional_response(request, etag=headers.get('ETag'), last_modified=last_modified,
+                                            response=response)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            headers = {header: response[header] for header in CACHED_HEADERS if response.has_header(header)}
+            response_cache.set(self.cache_namespace, key, (response.data, headers))
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
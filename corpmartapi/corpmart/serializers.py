@@ -2,16 +2,17 @@ import datetime as dt
 import json
 from rest_framework import exceptions
 from rest_framework import serializers
-from .models import OneTimePassword, User, Business, ContactRequest, Balancesheet, ViewHistory, ChatbotRequest, Blog, \
-    Testimonial
+from .models import OneTimePassword, User, Business, BusinessListing, ContactRequest, Balancesheet, ViewHistory, \
+    ChatbotRequest, Blog, Testimonial
 from rest_framework.authtoken.models import Token
 from django.core.exceptions import ObjectDoesNotExist
+from .images import srcset
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = '__all__'
+        fields = ['id', 'email', 'first_name', 'last_name', 'country_code', 'mobile', 'organisation_name']
 
 
 class SignupSerializer(serializers.ModelSerializer):
@@ -45,7 +46,7 @@ class PostBusinessSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Business
-        exclude = ['is_verified', 'admin_defined_selling_price', 'verified_by']
+        exclude = ['is_verified', 'admin_defined_selling_price', 'verified_by', 'search_vector']
 
 
 # Used for listing the businesses
@@ -57,6 +58,13 @@ class BusinessListSerializer(serializers.ModelSerializer):
                   'admin_defined_selling_price']
 
 
+# Same output as BusinessListSerializer, read from the listing table
+class BusinessListingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BusinessListing
+        fields = BusinessListSerializer.Meta.fields
+
+
 class BusinessDetailSerializer(serializers.ModelSerializer):
     balancesheet_available = serializers.SerializerMethodField(read_only=True)
     balancesheet_id = serializers.SerializerMethodField(read_only=True)
@@ -71,16 +79,14 @@ class BusinessDetailSerializer(serializers.ModelSerializer):
                   'has_bank_account', 'has_import_export_code', 'has_other_license', 'other_license', 'has_contacted',
                   'balancesheet_available', 'balancesheet_id']
 
-    @staticmethod
-    def get_balancesheet_available(obj):
-        b = Balancesheet.objects.filter(business__id=obj.id).first()
-        if b is not None:
-            return True
-        else:
-            return False
+    # balancesheet_pk and contacted are annotated by BusinessQuerySet.with_balancesheet_id and
+    # with_contacted, the queries below only run for instances loaded without them
+    def get_balancesheet_available(self, obj):
+        return self.get_balancesheet_id(obj) is not None
 
     def get_has_contacted(self, obj):
-        # contacted = None
+        if hasattr(obj, 'contacted'):
+            return obj.contacted
         try:
             if self.context['request'].user.is_authenticated:
                 user = self.context['request'].user
@@ -108,11 +114,10 @@ class BusinessDetailSerializer(serializers.ModelSerializer):
     #         return False
 
     def get_balancesheet_id(self, obj):
-        b = Balancesheet.objects.filter(business__id=obj.id).first()
-        if b is not None:
-            return b.id
-        else:
-            return None
+        if not hasattr(obj, 'balancesheet_pk'):
+            obj.balancesheet_pk = Balancesheet.objects.filter(business__id=obj.id).values_list('id', flat=True)\
+                .first()
+        return obj.balancesheet_pk
 
 
 class ContactRequestSerializer(serializers.ModelSerializer):
@@ -124,35 +129,71 @@ class ContactRequestSerializer(serializers.ModelSerializer):
         fields = ['requested_by', 'business']
 
 
+class BalancesheetListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        # storages that sign urls sign the whole page at once, the fields then read them from its cache
+        balancesheets = list(data.all() if hasattr(data, 'all') else data)
+        storage = Balancesheet._meta.get_field('file').storage
+        if hasattr(storage, 'urls'):
+            storage.urls([balancesheet.file.name for balancesheet in balancesheets if balancesheet.file])
+        return super().to_representation(balancesheets)
+
+
 class BalancesheetSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Balancesheet
         fields = ['file']
+        list_serializer_class = BalancesheetListSerializer
+
+
+class PictureSrcsetMixin(serializers.Serializer):
+    picture_srcset = serializers.SerializerMethodField(read_only=True)
+
+    @staticmethod
+    def get_picture_srcset(obj):
+        return srcset(obj.picture, obj.picture_derivatives)
 
 
-class BlogSerializer(serializers.ModelSerializer):
+class BlogSerializer(PictureSrcsetMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Blog
-        fields = '__all__'
+        exclude = ['picture_derivatives']
+
+
+# Used for the blog index, leaves out blog_text
+class BlogSummarySerializer(PictureSrcsetMixin, serializers.ModelSerializer):
 
+    class Meta:
+        model = Blog
+        fields = ['id', 'blog_title', 'picture', 'picture_srcset', 'created_at', 'updated_at', 'posted_by']
 
-class TestimonialSerializer(serializers.ModelSerializer):
+
+class TestimonialSerializer(PictureSrcsetMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Testimonial
-        fields = '__all__'
+        exclude = ['picture_derivatives']
 
 
 class ViewHistorySerializer(serializers.ModelSerializer):
     viewed_by = serializers.HiddenField(default=serializers.CurrentUserDefault())
-    business = BusinessDetailSerializer
+    business = BusinessListSerializer(read_only=True)
 
     class Meta:
         model = ViewHistory
-        fields = '__all__'
-        depth = 1
+        fields = ['id', 'business', 'viewed_by', 'viewed_at']
+
+
+# Used for listing a user's own contact requests
+class ContactRequestListSerializer(serializers.ModelSerializer):
+    business = BusinessListSerializer(read_only=True)
+
+    class Meta:
+        model = ContactRequest
+        fields = ['id', 'business', 'created_at', 'processed', 'status']
 
 
 class ChatbotRequestSerializer(serializers.ModelSerializer):
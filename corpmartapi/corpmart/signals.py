@@ -0,0 +1,139 @@
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .aggregates import business_bounds
+from .cards import card_cache
+from .facets import facet_index
+from .images import derivative_generator
+from rest_framework.authtoken.models import Token
+from .models import User, Business, BusinessListing, CurrentTransactionId, Balancesheet, Blog, Testimonial
+from .response_cache import response_cache
+from .tokens import token_profiles
+
+
+def businesses_changed_in_bulk(business_ids=None):
+    """
+    For writes that bypass the model signals (bulk_create, update): refreshes the search vectors and
+    listings of ``business_ids`` (all listings when None) and drops everything derived from the business table.
+    """
+    if business_ids is not None:
+        Business.objects.filter(id__in=business_ids).update_search_vector()
+    BusinessListing.objects.refresh(business_ids)
+    listings_changed_in_bulk()
+
+
+def listings_changed_in_bulk():
+    """
+    Drops everything derived from the listings once the transaction commits.
+    """
+    transaction.on_commit(facet_index.invalidate_everywhere)
+    transaction.on_commit(business_bounds.invalidate)
+    transaction.on_commit(lambda: response_cache.invalidate('business'))
+
+
+# response_cache namespace of the endpoints serving each model
+RESPONSE_CACHE_NAMESPACES = {
+    Blog: 'blog',
+    Testimonial: 'testimonial',
+    Business: 'business',
+    Balancesheet: 'business',
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_response_cache(sender, **kwargs):
+    namespace = RESPONSE_CACHE_NAMESPACES.get(sender)
+    if namespace is not None:
+        transaction.on_commit(lambda: response_cache.invalidate(namespace))
+
+
+@receiver(post_save, sender=Business)
+def update_search_vector(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) & set(Business.SEARCH_FIELDS):
+        Business.objects.filter(pk=instance.pk).update_search_vector()
+
+
+@receiver(post_save, sender=Business)
+def business_saved(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    BusinessListing.objects.refresh([instance.pk])
+    business_id = instance.pk
+    transaction.on_commit(lambda: card_cache.invalidate(business_id))
+
+    # what the row held before this save, then what it holds now for the instance's next save
+    previous = getattr(instance, '_loaded_values', None)
+    if update_fields:
+        saved = [Business._meta.get_field(name).attname for name in update_fields]
+    else:
+        saved = [field.attname for field in Business._meta.concrete_fields
+                 if field.attname not in instance.get_deferred_fields()]
+    instance._loaded_values = dict(previous or {}, **{field: getattr(instance, field) for field in saved})
+
+    if raw:
+        transaction.on_commit(facet_index.invalidate_everywhere)
+        transaction.on_commit(business_bounds.invalidate)
+        return
+    transaction.on_commit(lambda: facet_index.update_business(instance))
+    transaction.on_commit(lambda: business_bounds.business_saved(instance, created, previous))
+
+
+@receiver(post_delete, sender=Business)
+def business_deleted(sender, instance, **kwargs):
+    business_id = instance.id
+    BusinessListing.objects.filter(id=business_id).delete()
+    transaction.on_commit(lambda: card_cache.invalidate(business_id))
+    transaction.on_commit(lambda: facet_index.remove_business(business_id))
+    transaction.on_commit(lambda: business_bounds.business_deleted(instance))
+
+
+@receiver(post_save, sender=Balancesheet)
+def balancesheet_saved(sender, instance, **kwargs):
+    business_id = instance.business_id
+    BusinessListing.objects.filter(id=business_id).update(has_balancesheet=True, version=CurrentTransactionId())
+    transaction.on_commit(lambda: facet_index.set_balancesheet(business_id, True))
+
+
+@receiver(post_delete, sender=Balancesheet)
+def balancesheet_deleted(sender, instance, **kwargs):
+    business_id = instance.business_id
+    BusinessListing.objects.filter(id=business_id).update(has_balancesheet=False, version=CurrentTransactionId())
+    transaction.on_commit(lambda: facet_index.set_balancesheet(business_id, False))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: token_profiles.invalidate_user(user_id))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_profiles.invalidate_token(key))
+
+
+@receiver(post_save, sender=Blog)
+@receiver(post_save, sender=Testimonial)
+def picture_saved(sender, instance, raw=False, **kwargs):
+    if not raw and instance.picture and instance.picture.name != instance.picture_derivatives:
+        picture = instance.picture
+        pk = instance.pk
+
+        def derivatives_ready(name):
+            # runs on the image pool; update() skips post_save and bumping updated_at changes the ETag
+            close_old_connections()
+            if sender.objects.filter(pk=pk, picture=name).update(picture_derivatives=name, updated_at=timezone.now()):
+                response_cache.invalidate(RESPONSE_CACHE_NAMESPACES[sender])
+
+        transaction.on_commit(lambda: derivative_generator.schedule(picture, derivatives_ready))
+
+
+@receiver(post_delete, sender=Blog)
+@receiver(post_delete, sender=Testimonial)
+def picture_deleted(sender, instance, **kwargs):
+    if instance.picture:
+        picture = instance.picture
+        transaction.on_commit(lambda: derivative_generator.schedule_delete(picture))
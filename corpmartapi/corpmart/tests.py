@@ -0,0 +1,310 @@
+"""
+Tests of the business list, detail and view history endpoints (query counts, query plans, facet
+index, bounds), of the OTP and lead export endpoints and of the notification dispatcher. The views
+are called through ``APIRequestFactory`` so they don't depend on the url configuration, emails go
+to Django's locmem backend.
+"""
+import csv
+import io
+import json
+import smtplib
+from collections import Counter
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .aggregates import business_bounds
+from .cards import card_cache
+from .facets import FacetIndex, facet_index
+from .models import User, Business, BusinessListing, Balancesheet, Blog, ContactRequest, ViewHistory
+from .notifications import Email, NotificationDispatcher, notification_dispatcher
+from .querycheck import QueryDetector
+from .queryplans import check_plans
+from .response_cache import response_cache
+from .view_history import view_history_recorder
+from .views import BlogViewset, BusinessListViewset, BusinessDetailViewset, LeadExportView, SendOTPView, \
+    ViewHistoryViewset, client_ip
+
+
+def create_business(user, name, **fields):
+    return Business.objects.create(is_verified=True, posted_by=user, business_name=name, state='Goa',
+                                   industry='BANKING', **fields)
+
+
+class ViewTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@example.com', 9000000001)
+        seller = User.objects.create_user('seller@example.com', 9000000002)
+        cls.businesses = [create_business(seller, f"Business {i}", admin_defined_selling_price=100000 * i)
+                          for i in range(1, 7)]
+        Balancesheet.objects.create(business=cls.businesses[0], file='balancesheet/test.pdf')
+        ContactRequest.objects.create(requested_by=cls.user, business=cls.businesses[0])
+        for business in cls.businesses:
+            ViewHistory.objects.create(viewed_by=cls.user, business=business)
+        # the listing refresh normally runs on commit, which never happens inside a TestCase
+        BusinessListing.objects.refresh()
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        card_cache.clear()
+        facet_index.invalidate()
+        response_cache.invalidate('business')
+
+    def get(self, view, path, params=None, user=None):
+        request = self.factory.get(path, params or {})
+        if user is not None:
+            force_authenticate(request, user=user)
+        response = view(request)
+        response.render()
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+
+class EndpointQueryCountTests(ViewTestCase):
+
+    def test_business_list(self):
+        view = BusinessListViewset.as_view({'get': 'list'})
+        # builds the facet index
+        self.get(view, '/businesses/')
+
+        response_cache.invalidate('business')
+        card_cache.clear()
+        # the listing versions and the listings of the missing cards
+        with self.assertNumQueries(2):
+            self.get(view, '/businesses/', {'state': 'Goa'})
+
+        response_cache.invalidate('business')
+        # only the versions, every card is cached
+        with self.assertNumQueries(1):
+            self.get(view, '/businesses/', {'state': 'Goa'})
+
+        with self.assertNumQueries(0):
+            self.get(view, '/businesses/', {'state': 'Goa'})
+
+    def test_business_detail(self):
+        view = BusinessDetailViewset.as_view({'get': 'list'})
+        business = self.businesses[0]
+        with mock.patch.object(view_history_recorder, 'record') as record:
+            # balancesheet and contact request are annotated on the business query
+            with self.assertNumQueries(1):
+                response = self.get(view, '/business-detail/', {'business_id': business.id}, user=self.user)
+        record.assert_called_once_with(self.user.id, business.id)
+        self.assertTrue(response.data[0]['balancesheet_available'])
+        self.assertTrue(response.data[0]['has_contacted'])
+
+        with self.assertNumQueries(1):
+            response = self.get(view, '/business-detail/', {'business_id': self.businesses[1].id})
+        self.assertFalse(response.data[0]['balancesheet_available'])
+        self.assertFalse(response.data[0]['has_contacted'])
+
+    def test_blog_list(self):
+        Blog.objects.create(blog_title="Selling a company", blog_text="...", posted_by="corpmart")
+        view = BlogViewset.as_view({'get': 'list'})
+        response_cache.invalidate('blog')
+        etag = self.get(view, '/blogs/')['ETag']
+
+        # cache hits are answered with the stored validators, without the aggregate query
+        with self.assertNumQueries(0):
+            self.get(view, '/blogs/')
+        with self.assertNumQueries(0):
+            response = view(self.factory.get('/blogs/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+
+    def test_view_history(self):
+        view = ViewHistoryViewset.as_view({'get': 'list'})
+        # the views with their businesses, plus the count when the list is paginated
+        with QueryDetector(budget=2, repeat_threshold=len(self.businesses), fail_on_repeats=True):
+            self.get(view, '/view-history/', user=self.user)
+
+
+class QueryPlanTests(ViewTestCase):
+
+    def test_every_query_has_an_index(self):
+        # the same checks as the check_query_plans command, sequential scans are off inside the test transaction
+        for name, status, tables in check_plans(self.user):
+            with self.subTest(name):
+                self.assertEqual(status, 'ok', tables)
+
+
+class FacetIndexTests(ViewTestCase):
+
+    def list_with_counts(self):
+        response_cache.invalidate('business')
+        view = BusinessListViewset.as_view({'get': 'list'})
+        data = json.loads(self.get(view, '/businesses/', {'state': 'Goa', 'facets': 'state'}).content)
+        return {card['id'] for card in data['results']}, data['facets']['state']['Goa']
+
+    def test_change_on_another_instance(self):
+        self.list_with_counts()
+        # another instance moves a business to another state: its listing changes and the shared version
+        # moves, no signal reaches this process
+        BusinessListing.objects.filter(id=self.businesses[0].id).update(state='Assam')
+        cache.incr(FacetIndex.version_key)
+
+        ids, count = self.list_with_counts()
+        self.assertEqual(ids, {business.id for business in self.businesses[1:]})
+        self.assertEqual(count, len(self.businesses) - 1)
+
+    def test_page_backfilled_when_listings_are_missing(self):
+        self.list_with_counts()
+        # the listing is gone without anything telling the index
+        BusinessListing.objects.filter(id=self.businesses[0].id).delete()
+
+        ids, count = self.list_with_counts()
+        self.assertEqual(ids, {business.id for business in self.businesses[1:]})
+        self.assertEqual(count, len(self.businesses) - 1)
+
+
+class BusinessBoundsTests(ViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        business_bounds.invalidate()
+        business_bounds.get()
+
+    def assertCached(self, cached):
+        self.assertEqual(cache.get(business_bounds.cache_key) is not None, cached)
+
+    def test_save_inside_bounds_keeps_record(self):
+        business = Business.objects.get(id=self.businesses[2].id)
+        business_bounds.business_saved(business, False, business._loaded_values)
+        self.assertCached(True)
+
+    def test_save_widening_bounds_drops_record(self):
+        business = Business.objects.get(id=self.businesses[2].id)
+        previous = business._loaded_values
+        business.admin_defined_selling_price = 10 ** 9
+        business_bounds.business_saved(business, False, previous)
+        self.assertCached(False)
+
+    def test_partially_loaded_save_drops_record(self):
+        # holds the highest selling price, which wasn't loaded
+        business = Business.objects.only('id', 'business_name').get(id=self.businesses[-1].id)
+        business_bounds.business_saved(business, False, business._loaded_values)
+        self.assertCached(False)
+
+
+class LeadExportTests(ViewTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user('admin@example.com', 9000000009, is_staff=True)
+        ContactRequest.objects.create(requested_by=self.user, business=self.businesses[1], processed=True)
+
+    def export(self, processed):
+        request = self.factory.get('/lead-export/', {'type': 'contact', 'processed': processed})
+        force_authenticate(request, user=self.admin)
+        return LeadExportView.as_view()(request)
+
+    def test_processed_filter(self):
+        for value, expected in (('true', ['True']), ('1', ['True']), ('false', ['False']), ('0', ['False'])):
+            response = self.export(value)
+            self.assertEqual(response.status_code, 200)
+            rows = csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode()))
+            self.assertEqual([row['processed'] for row in rows], expected, value)
+
+    def test_invalid_processed(self):
+        self.assertEqual(self.export('maybe').status_code, 400)
+
+
+class SendOTPTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def test_client_ip_ignores_client_supplied_entries(self):
+        request = self.factory.post('/send-otp/', HTTP_X_FORWARDED_FOR='10.0.0.1, 203.0.113.7',
+                                    REMOTE_ADDR='169.254.1.1')
+        self.assertEqual(client_ip(request), '203.0.113.7')
+        with override_settings(CORPMART_PROXY_HOPS=2):
+            self.assertEqual(client_ip(request), '10.0.0.1')
+        with override_settings(CORPMART_PROXY_HOPS=0):
+            self.assertEqual(client_ip(request), '169.254.1.1')
+
+    def test_unknown_number_gets_the_same_answer(self):
+        User.objects.create_user('registered@example.com', 9000000003)
+        view = SendOTPView.as_view()
+        with mock.patch.object(notification_dispatcher, 'enqueue') as enqueue:
+            known = view(self.factory.post('/send-otp/', {'mobile': 9000000003}, format='json'))
+            unknown = view(self.factory.post('/send-otp/', {'mobile': 9000000004}, format='json'))
+        self.assertEqual((known.status_code, known.data), (unknown.status_code, unknown.data))
+        enqueue.assert_called_once()
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """
+    Counts the connections opened and fails the sends to ``failures`` recipients as often as listed.
+    """
+    opened = 0
+    failures = {}
+    attempts = Counter()
+
+    def open(self):
+        type(self).opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            recipient = message.to[0]
+            self.attempts[recipient] += 1
+            if self.failures.get(recipient):
+                self.failures[recipient] -= 1
+                raise smtplib.SMTPRecipientsRefused({recipient: (550, b"refused")})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='corpmart.tests.CountingEmailBackend')
+class NotificationDispatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        mail.outbox = []
+        CountingEmailBackend.opened = 0
+        CountingEmailBackend.failures = {}
+        CountingEmailBackend.attempts = Counter()
+        self.dispatcher = NotificationDispatcher(workers=1, retries=2, backoff=0)
+        self.emails = [Email("Subject", "Body", [f"admin{i}@example.com"]) for i in range(3)]
+
+    def sent_to(self):
+        return sorted(recipient for message in mail.outbox for recipient in message.to)
+
+    def test_batch_over_one_connection(self):
+        self.dispatcher.deliver(self.emails)
+        self.assertEqual(self.sent_to(), ["admin0@example.com", "admin1@example.com", "admin2@example.com"])
+        self.assertEqual(CountingEmailBackend.opened, 1)
+
+    def test_retries_only_failed_messages(self):
+        CountingEmailBackend.failures = {"admin1@example.com": 1}
+        self.dispatcher.deliver(self.emails)
+        self.assertEqual(self.sent_to(), ["admin0@example.com", "admin1@example.com", "admin2@example.com"])
+        self.assertEqual(CountingEmailBackend.attempts["admin0@example.com"], 1)
+        self.assertEqual(CountingEmailBackend.attempts["admin1@example.com"], 2)
+
+    def test_failure_after_last_retry(self):
+        CountingEmailBackend.failures = {"admin1@example.com": 10}
+        with self.assertLogs('corpmart.notifications', 'ERROR') as logs:
+            self.dispatcher.deliver(self.emails)
+        self.assertEqual(self.sent_to(), ["admin0@example.com", "admin2@example.com"])
+        self.assertEqual(CountingEmailBackend.attempts["admin1@example.com"], 3)
+        self.assertIn("admin1@example.com", logs.output[0])
+
+    def test_no_retries(self):
+        CountingEmailBackend.failures = {"admin1@example.com": 1}
+        dispatcher = NotificationDispatcher(workers=1, retries=0, backoff=0)
+        with self.assertLogs('corpmart.notifications', 'ERROR'):
+            dispatcher.deliver(self.emails)
+        self.assertEqual(CountingEmailBackend.attempts["admin1@example.com"], 1)
+
+    @override_settings(CORPMART_NOTIFICATIONS_ASYNC=True)
+    def test_drain_delivers_queued_jobs(self):
+        with mock.patch('corpmart.notifications.atexit.register') as register:
+            for email in self.emails:
+                self.dispatcher.enqueue(email)
+        register.assert_called_once_with(self.dispatcher.drain)
+        self.dispatcher.drain()
+        self.assertEqual(self.sent_to(), ["admin0@example.com", "admin1@example.com", "admin2@example.com"])
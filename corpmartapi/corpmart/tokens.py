@@ -0,0 +1,54 @@
+"""
+Token -> profile lookups for ValidateTokenView, which every app launch hits.
+"""
+import threading
+
+from cachetools import TTLCache
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+
+PROFILE_FIELDS = ('first_name', 'last_name', 'email', 'mobile', 'organisation_name')
+
+
+class TokenProfileCache:
+    """
+    Bounded cache of token key -> profile dict, filled with one ``values()`` query per miss and
+    invalidated from the ``User`` and ``Token`` signals. Signals only reach the instance that made the
+    change, so entries live ``CORPMART_TOKEN_CACHE_TTL`` seconds (default 30): that is how long a
+    deleted token or deactivated user can still validate on the other instances.
+    """
+    def __init__(self, maxsize=None, ttl=None):
+        self._profiles = TTLCache(maxsize or getattr(settings, 'CORPMART_TOKEN_CACHE_SIZE', 10000),
+                                  ttl or getattr(settings, 'CORPMART_TOKEN_CACHE_TTL', 30))
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the profile of the active user owning ``key``, or None for an unknown token.
+        """
+        with self._lock:
+            entry = self._profiles.get(key)
+        if entry is not None:
+            return entry[1]
+
+        row = Token.objects.filter(key=key, user__is_active=True)\
+            .values('user_id', *(f'user__{field}' for field in PROFILE_FIELDS)).first()
+        if row is None:
+            return None
+        profile = {field: row[f'user__{field}'] for field in PROFILE_FIELDS}
+        with self._lock:
+            self._profiles[key] = (row['user_id'], profile)
+        return profile
+
+    def invalidate_token(self, key):
+        with self._lock:
+            self._profiles.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key, (owner, _) in self._profiles.items() if owner == user_id]:
+                del self._profiles[key]
+
+
+token_profiles = TokenProfileCache()
@@ -0,0 +1,103 @@
+"""
+Buffered view history recording, so business detail requests don't write to the database.
+"""
+import atexit
+import logging
+import threading
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Business, User, ViewHistory
+
+
+logger = logging.getLogger(__name__)
+
+
+class ViewHistoryRecorder:
+    """
+    Collects (user, business) views in memory and writes them from a background thread, every
+    ``batch_size`` distinct views or every ``flush_interval`` seconds, whichever comes first.
+    Repeat views inside one batch collapse into one row and repeat views of an already recorded
+    business move its ``viewed_at`` forward.
+    """
+    def __init__(self, batch_size=None, flush_interval=None):
+        self.batch_size = batch_size or getattr(settings, 'CORPMART_VIEW_HISTORY_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval or getattr(settings, 'CORPMART_VIEW_HISTORY_FLUSH_INTERVAL', 5)
+        self._pending = {}
+        self._lock = threading.Lock()
+        # held for a whole flush, so flush() returns only once views taken by a concurrent flush are written
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+
+    def record(self, user_id, business_id):
+        asynchronous = getattr(settings, 'CORPMART_VIEW_HISTORY_ASYNC', True)
+        with self._lock:
+            self._pending[user_id, business_id] = timezone.now()
+            full = len(self._pending) >= self.batch_size
+            if asynchronous and self._worker is None:
+                self._start_worker()
+        if not asynchronous:
+            self.flush()
+        elif full:
+            self._wakeup.set()
+
+    def _start_worker(self):
+        self._worker = threading.Thread(target=self._run, name='view-history-recorder', daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write view history")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            except Exception:
+                # keep the views for the next attempt unless they were viewed again in the meantime
+                with self._lock:
+                    for key, viewed_at in pending.items():
+                        self._pending.setdefault(key, viewed_at)
+                raise
+
+    @staticmethod
+    def _write(pending):
+        # businesses or users deleted since the view would fail the whole insert
+        user_ids = set(User.objects.filter(id__in={user_id for user_id, _ in pending}).values_list('id', flat=True))
+        business_ids = set(Business.objects.filter(id__in={business_id for _, business_id in pending})
+                           .values_list('id', flat=True))
+        pending = {(user_id, business_id): viewed_at for (user_id, business_id), viewed_at in pending.items()
+                   if user_id in user_ids and business_id in business_ids}
+        if not pending:
+            return
+
+        existing = list(ViewHistory.objects.filter(reduce(or_, (
+            Q(viewed_by_id=user_id, business_id=business_id) for user_id, business_id in pending
+        ))))
+        for view in existing:
+            view.viewed_at = pending.pop((view.viewed_by_id, view.business_id))
+        ViewHistory.objects.bulk_update(existing, ['viewed_at'])
+        ViewHistory.objects.bulk_create([
+            ViewHistory(viewed_by_id=user_id, business_id=business_id, viewed_at=viewed_at)
+            for (user_id, business_id), viewed_at in pending.items()
+        ], ignore_conflicts=True)
+
+
+view_history_recorder = ViewHistoryRecorder()
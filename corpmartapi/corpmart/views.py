@@ -1,23 +1,43 @@
-from random import randint
 import datetime as dt
-from django.db.models import Max
-import requests
+import hashlib
+import mimetypes
+import os
+from django.db.models import F, OuterRef, Subquery
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
-from django.contrib.auth import authenticate
-from django.core.mail import send_mail
+from django.utils.cache import get_conditional_response, patch_cache_control
 from rest_framework import permissions
-from django.contrib.postgres.search import SearchQuery, SearchVector
-from rest_framework import filters
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from rest_framework import exceptions, filters
 from rest_framework import viewsets, views, generics
+from rest_framework.authentication import get_authorization_header
 from rest_framework.authtoken.models import Token
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
-from .models import User, OneTimePassword, Business, Balancesheet, ViewHistory, ChatbotNotification, Blog, Testimonial
-from .serializers import UserSerializer, SignupSerializer, BusinessListSerializer, BusinessDetailSerializer, \
-    PostBusinessSerializer, ContactRequestSerializer, BalancesheetSerializer, ViewHistorySerializer,\
-    ChatbotRequestSerializer, BlogSerializer, TestimonialSerializer
-from django.core.exceptions import ObjectDoesNotExist
+from .models import User, OneTimePassword, Business, BusinessListing, Balancesheet, ViewHistory, Blog, Testimonial
+from .models import ContactRequest as ContactRequestModel, ChatbotRequest as ChatbotRequestModel
+from .serializers import UserSerializer, SignupSerializer, BusinessListSerializer, BusinessListingSerializer, \
+    BusinessDetailSerializer, PostBusinessSerializer, ContactRequestSerializer, BalancesheetSerializer, \
+    ViewHistorySerializer, ChatbotRequestSerializer, BlogSerializer, BlogSummarySerializer, TestimonialSerializer, \
+    ContactRequestListSerializer
+from .aggregates import business_bounds
+from .cards import CardJSONRenderer, card_cache
+from .conditional import ConditionalGetMixin
+from .downloads import RangeNotSatisfiable, iter_range, parse_range
+from .exports import CONTACT_REQUEST_COLUMNS, CHATBOT_REQUEST_COLUMNS, stream_csv
+from .facets import FacetQuery, SORT_OPTIONS, facet_index, parse_facets
+from .instrumentation import InstrumentedViewMixin, metrics_registry
+from .notifications import notification_dispatcher
+from .otp import RateLimited, otp_service
+from .pagination import BusinessCursorPagination, OptionalPageNumberPagination
+from .response_cache import CachedResponseMixin
+from .tokens import token_profiles
+from .view_history import view_history_recorder
 
 
 
@@ -43,24 +63,42 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = User.objects.filter(mobile=user_mobile)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        # id, email and mobile are all unique, the lookup is one index scan returning just the profile
+        return Response(list(self.get_queryset().values(*self.serializer_class.Meta.fields)))
 
-class BlogViewset(viewsets.ReadOnlyModelViewSet):
+
+class BlogViewset(InstrumentedViewMixin, CachedResponseMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
-    Allow users to be view blogs
+    Allow users to be view blogs, ?summary leaves blog_text out of the list
     """
+    cache_namespace = 'blog'
     serializer_class = BlogSerializer
     permission_classes = ()
-    pagination_class = None
+    pagination_class = OptionalPageNumberPagination
     queryset = Blog.objects.all().order_by('-updated_at')
 
+    def get_serializer_class(self):
+        if self.action == 'list' and self.request.query_params.get('summary') is not None:
+            return BlogSummarySerializer
+        return self.serializer_class
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list' and self.request.query_params.get('summary') is not None:
+            queryset = queryset.defer('blog_text')
+        return queryset
+
 
-class TestimonialViewset(viewsets.ReadOnlyModelViewSet):
+class TestimonialViewset(InstrumentedViewMixin, CachedResponseMixin, ConditionalGetMixin,
+                         viewsets.ReadOnlyModelViewSet):
     """
     Allow users to be view blogs
     """
+    cache_namespace = 'testimonial'
     serializer_class = TestimonialSerializer
     permission_classes = ()
-    pagination_class = None
+    pagination_class = OptionalPageNumberPagination
     queryset = Testimonial.objects.all().order_by('-updated_at')
 
 
@@ -75,16 +113,81 @@ class PostBusiness(generics.CreateAPIView):
                         is_verified=False)
 
 
-class BusinessListViewset(viewsets.ReadOnlyModelViewSet):
+class BusinessListViewset(InstrumentedViewMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """
-    Allows business list to be viewed and queried
+    Allows business list to be viewed and queried, served from the BusinessListing read model
     """
-    serializer_class = BusinessListSerializer
+    cache_namespace = 'business'
+    serializer_class = BusinessListingSerializer
+    renderer_classes = (CardJSONRenderer, BrowsableAPIRenderer)
     permission_classes = ()
 
+    @property
+    def paginator(self):
+        """
+        Passing ?cursor= (empty for the first page) switches to keyset pagination.
+        """
+        if not hasattr(self, '_paginator'):
+            if BusinessCursorPagination.cursor_query_param in self.request.query_params:
+                self._paginator = BusinessCursorPagination()
+            else:
+                self._paginator = None if self.pagination_class is None else self.pagination_class()
+        return self._paginator
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self.filtered_list, *args, **kwargs)
+
+    def filtered_list(self, request, *args, **kwargs):
+        facet_query = None
+        if not isinstance(self.paginator, BusinessCursorPagination):
+            facet_query = FacetQuery.parse(request.query_params)
+        if facet_query is None:
+            queryset = self.filter_queryset(self.get_queryset())
+            page = self.paginate_queryset(queryset)
+            if page is not None:
+                return self.get_paginated_response(card_cache.cards_for_listings(page, self.serializer_class))
+            return Response(card_cache.cards_for_listings(queryset, self.serializer_class))
+
+        # full-text search runs in postgres, everything else including the facet counts on the index
+        search = request.query_params.get('search')
+        if search is not None:
+            facet_query.restrict_to = list(self.search(Business.objects.filter(is_verified=True), search)
+                                           .order_by('-rank', 'id').values_list('id', flat=True))
+        facets = parse_facets(request.query_params.get('facets'))
+        counts, page, versions = self.facet_page(facet_query, facets)
+        if len(versions) < len(page):
+            # the index still holds businesses whose listing is gone, rebuild it and fill the page again
+            facet_index.invalidate()
+            counts, page, versions = self.facet_page(facet_query, facets)
+        cards = card_cache.cards([(i, versions[i]) for i in page if i in versions], self.serializer_class)
+        if self.paginator is None:
+            response = Response({"results": cards} if facets else cards)
+        else:
+            response = self.get_paginated_response(cards)
+        if facets:
+            response.data['facets'] = counts
+        return response
+
+    def facet_page(self, facet_query, facets):
+        """
+        The facet counts, the ids of the requested page and the listing versions of those ids.
+        """
+        ids, counts = facet_index.filter(facet_query, facets)
+        page = self.paginate_queryset(ids)
+        if page is None:
+            page = ids[:]
+        # only the versions are read, the cards come from card_cache unless they changed
+        versions = dict(BusinessListing.objects.filter(id__in=page).values_list('id', 'version'))
+        return counts, page, versions
+
+    @staticmethod
+    def search(queryset, search):
+        query = SearchQuery(search)
+        return queryset.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query))
+
     def get_queryset(self):
-        queryset = Business.objects.all()
-        queryset = queryset.filter(is_verified=True)
+        # only verified businesses have a listing
+        queryset = BusinessListing.objects.all()
         state = self.request.query_params.get('state')
         country = self.request.query_params.get('country')
         company_type = self.request.query_params.get('company_type')
@@ -137,35 +240,21 @@ class BusinessListViewset(viewsets.ReadOnlyModelViewSet):
         if import_export_code is not None:
             queryset = queryset.filter(has_import_export_code=import_export_code)
         if balancesheet is not None:
-            queryset = queryset.filter(balancesheets__isnull=False)
+            queryset = queryset.filter(has_balancesheet=True)
         if search is not None:
-            queryset = queryset.annotate(
-                search=SearchVector('sale_description'),
-            ).filter(search=search)
-        if sort_by is not None:
-            if sort_by == "1":
-                # latest first
-                queryset = queryset.order_by('-year_of_incorporation')
-            elif sort_by == "2":
-                queryset = queryset.order_by('year_of_incorporation')
-            elif sort_by == "3":
-                # ascending
-                queryset = queryset.order_by('authorised_capital')
-            elif sort_by == "4":
-                queryset = queryset.order_by('-authorised_capital')
-            elif sort_by == "5":
-                queryset = queryset.order_by('paidup_capital')
-            elif sort_by == "6":
-                queryset = queryset.order_by('-paidup_capital')
-            elif sort_by == "7":
-                queryset = queryset.order_by('admin_defined_selling_price')
-            elif sort_by == "8":
-                queryset = queryset.order_by('-admin_defined_selling_price')
+            matches = self.search(Business.objects.filter(is_verified=True), search)
+            queryset = queryset.filter(id__in=matches.values('id'))\
+                .annotate(rank=Subquery(matches.filter(id=OuterRef('id')).values('rank')[:1]))
+        if sort_by in SORT_OPTIONS:
+            field, descending = SORT_OPTIONS[sort_by]
+            queryset = queryset.order_by(f"-{field}" if descending else field)
+        elif search is not None:
+            queryset = queryset.order_by('-rank', 'id')
 
         return queryset
 
 
-class BusinessDetailViewset(viewsets.ReadOnlyModelViewSet):
+class BusinessDetailViewset(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     Allows business detail to be viewed
     """
@@ -175,21 +264,20 @@ class BusinessDetailViewset(viewsets.ReadOnlyModelViewSet):
     queryset = Business.objects.all()
 
     def get_queryset(self):
-
         business_id = self.request.query_params.get('business_id')
-        queryset = Business.objects.filter(id=business_id)
+        queryset = Business.objects.filter(id=business_id).defer('search_vector').with_balancesheet_id()
+        if self.request.user.is_authenticated:
+            queryset = queryset.with_contacted(self.request.user)
+        return queryset
 
-        # updating view history
-        business = Business.objects.get(id=business_id)
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
 
-        if self.request.user.is_authenticated:
-            user = self.request.user
-            try:
-                viewhistory, created = ViewHistory.objects.get_or_create(viewed_by=user, business=business)
-            except ObjectDoesNotExist:
-                pass
+        # updating view history
+        if request.user.is_authenticated and response.data:
+            view_history_recorder.record(request.user.id, response.data[0]['id'])
 
-        return queryset
+        return response
 
 
 class ContactRequest(generics.CreateAPIView):
@@ -258,7 +346,7 @@ class ContactRequest(generics.CreateAPIView):
 #                             status=status.HTTP_400_BAD_REQUEST)
 
 
-class BalancesheetViewset(viewsets.ReadOnlyModelViewSet):
+class BalancesheetViewset(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     For viewing balancesheets
     """
@@ -269,7 +357,6 @@ class BalancesheetViewset(viewsets.ReadOnlyModelViewSet):
         # queryset = Balancesheet.objects.none()
         # user = self.request.user
         balancesheet_id = self.request.query_params.get('balancesheet_id')
-        b = Balancesheet.objects.get(pk=balancesheet_id)
         # bp = BalancesheetPayment.objects.filter(balancesheet=b, user=user, payment_successful=True).first()
         # has_paid = bp.payment_sucessful
 
@@ -279,74 +366,267 @@ class BalancesheetViewset(viewsets.ReadOnlyModelViewSet):
         return queryset
 
 
-class ViewHistoryViewset(viewsets.ReadOnlyModelViewSet):
+class BalancesheetDownloadView(APIView):
+    """
+    Streams a balancesheet file in chunks, honouring Range, If-Range and If-None-Match. Storages that
+    sign urls get a redirect to the signed url instead.
+    """
+    chunk_size = 64 * 1024
+
+    def get(self, request,):
+        balancesheet_id = request.query_params.get('balancesheet_id')
+        balancesheet = Balancesheet.objects.filter(id=balancesheet_id).first() if balancesheet_id else None
+        if balancesheet is None or not balancesheet.file:
+            raise exceptions.NotFound()
+
+        name = balancesheet.file.name
+        etag = '"%s"' % hashlib.md5(f"{balancesheet.id}:{name}:{balancesheet.uploaded_on.timestamp()}"
+                                    .encode()).hexdigest()
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        storage = balancesheet.file.storage
+        if getattr(storage, 'signs_urls', False):
+            # the client downloads straight from the bucket
+            return HttpResponseRedirect(storage.url(name))
+
+        size = storage.size(name)
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is not None and if_range != etag:
+            range_header = None
+        try:
+            byte_range = parse_range(range_header, size) if size else None
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(iter_range(storage, name, start, end, self.chunk_size),
+                                         content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if byte_range is not None:
+            response.status_code = status.HTTP_206_PARTIAL_CONTENT
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1 if size else 0
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{os.path.basename(name)}"'
+        return response
+
+
+class ViewHistoryViewset(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     For viewing balancesheets
     """
     serializer_class = ViewHistorySerializer
-    pagination_class = None
 
     def get_queryset(self):
         user = self.request.user
-        queryset = ViewHistory.objects.filter(viewed_by=user).order_by('-viewed_at')
+        queryset = ViewHistory.objects.filter(viewed_by=user).select_related('business')\
+            .defer('business__search_vector').order_by('-viewed_at')
 
         return queryset
 
 
-class UserBusinessViewset(viewsets.ReadOnlyModelViewSet):
+class UserBusinessViewset(InstrumentedViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     For viewing balancesheets
     """
     serializer_class = BusinessListSerializer
-    pagination_class = None
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Business.objects.filter(posted_by=user).order_by('-year_of_incorporation')
+        queryset = Business.objects.filter(posted_by=user).only(*BusinessListSerializer.Meta.fields)\
+            .order_by('-year_of_incorporation')
 
         return queryset
 
 
-class MaxValueView(APIView):
+class DashboardView(APIView):
+    """
+    The user's businesses, recently viewed businesses and contact requests in one response
+    """
+    limit = 20
+
+    def get(self, request,):
+        user = request.user
+        businesses = Business.objects.filter(posted_by=user).only(*BusinessListSerializer.Meta.fields)\
+            .order_by('-year_of_incorporation')[:self.limit]
+        recent_views = ViewHistory.objects.filter(viewed_by=user).select_related('business')\
+            .defer('business__search_vector').order_by('-viewed_at')[:self.limit]
+        contact_requests = user.contactrequests.select_related('business').defer('business__search_vector')\
+            .order_by('-created_at')[:self.limit]
+
+        context = {'request': request}
+        return Response({
+            "businesses": BusinessListSerializer(businesses, many=True, context=context).data,
+            "recent_views": ViewHistorySerializer(recent_views, many=True, context=context).data,
+            "contact_requests": ContactRequestListSerializer(contact_requests, many=True, context=context).data,
+        })
+
+
+class MaxValueView(CachedResponseMixin, APIView):
     permission_classes = ()
+    cache_namespace = 'business'
 
     def get(self, request,):
         """
-        Return max values.
+        Return max and min values of verified businesses.
         """
-        max_selling_price = Business.objects.all().aggregate(
-            Max('admin_defined_selling_price'))['admin_defined_selling_price__max']
-        max_auth_capital = Business.objects.all().aggregate(
-            Max('authorised_capital'))['authorised_capital__max']
-        max_paidup_capital = Business.objects.all().aggregate(
-            Max('paidup_capital'))['paidup_capital__max']
+        return self.cached_response(request, self.bounds)
 
-        return Response({"max_selling_price": max_selling_price, "max_auth_capital": max_auth_capital,
-                         "max_paidup_capital": max_paidup_capital}, )
+    @staticmethod
+    def bounds(request):
+        values, etag = business_bounds.get()
+        response = Response(values)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True,
+                            max_age=getattr(settings, 'CORPMART_BUSINESS_BOUNDS_MAX_AGE', 60))
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+def client_ip(request):
+    """
+    The address the request came from as seen by the first trusted proxy. Each of the
+    ``CORPMART_PROXY_HOPS`` proxies in front of the app (default 1, the App Engine front end) appends
+    the address it received the request from to X-Forwarded-For, everything before those entries was
+    sent by the client and can't be trusted.
+    """
+    hops = getattr(settings, 'CORPMART_PROXY_HOPS', 1)
+    forwarded_for = [entry.strip() for entry in request.META.get('HTTP_X_FORWARDED_FOR', '').split(",")
+                     if entry.strip()]
+    if hops and len(forwarded_for) >= hops:
+        return forwarded_for[-hops]
+    return request.META.get('REMOTE_ADDR')
+
+
+class SendOTPView(APIView):
+    """
+    Sends a one time password to the posted mobile number. Unknown numbers get the same answer, so the
+    endpoint can't be used to find out which numbers are registered.
+    """
+    permission_classes = ()
+
+    def post(self, request,):
+        mobile = request.data.get("mobile")
+        if not str(mobile or "").isdigit():
+            return Response({"error": "Mobile number is required"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            otp_service.issue(str(mobile), client_ip(request))
+        except RateLimited as e:
+            raise exceptions.Throttled(wait=e.wait)
+        except User.DoesNotExist:
+            pass
+        return Response({"success": "OTP sent"}, )
+
+
+class VerifyOTPView(APIView):
+    """
+    Exchanges a mobile number and one time password for the user's token
+    """
+    permission_classes = ()
+
+    def post(self, request,):
+        mobile = request.data.get("mobile")
+        otp = request.data.get("otp")
+        if not str(mobile or "").isdigit() or not otp:
+            return Response({"error": "Wrong Credentials"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_id = otp_service.verify(str(mobile), otp)
+        except RateLimited as e:
+            raise exceptions.Throttled(wait=e.wait)
+        if user_id is None:
+            return Response({"error": "Wrong Credentials"}, status=status.HTTP_400_BAD_REQUEST)
+        token, created = Token.objects.get_or_create(user_id=user_id)
+        return Response({"token": token.key}, )
 
 
 class ValidateTokenView(APIView):
+    """
+    Returns the profile of the token's user. Token auth headers are answered from token_profiles
+    without loading the user, anything else goes through the configured authentication.
+    """
+    permission_classes = ()
+
+    def perform_authentication(self, request):
+        pass
+
+    def get(self, request,):
+        auth = get_authorization_header(request).split()
+        if len(auth) == 2 and auth[0].lower() == b'token':
+            try:
+                profile = token_profiles.get(auth[1].decode())
+            except UnicodeError:
+                profile = None
+            if profile is None:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            return Response(profile)
+
+        user = request.user
+        if not user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        return Response({"first_name": user.first_name, "last_name": user.last_name, "email": user.email,
+                         "mobile": user.mobile, "organisation_name": user.organisation_name}, )
+
+
+# accepted values of boolean query params
+BOOLEAN_PARAMS = {'true': True, '1': True, 'false': False, '0': False}
+
+
+class LeadExportView(APIView):
+    """
+    Staff only CSV export of contact requests (?type=contact) or chatbot requests (?type=chatbot),
+    filtered by ?processed=true/false, ?created_after and ?created_before (YYYY-MM-DD)
+    """
+    permission_classes = (permissions.IsAdminUser,)
 
     def get(self, request,):
+        lead_type = request.query_params.get('type', 'contact')
+        if lead_type == 'contact':
+            queryset, columns = ContactRequestModel.objects.all(), CONTACT_REQUEST_COLUMNS
+        elif lead_type == 'chatbot':
+            queryset, columns = ChatbotRequestModel.objects.all(), CHATBOT_REQUEST_COLUMNS
+        else:
+            return Response({"error": "type must be contact or chatbot"}, status=status.HTTP_400_BAD_REQUEST)
+
+        processed = request.query_params.get('processed')
+        created_after = request.query_params.get('created_after')
+        created_before = request.query_params.get('created_before')
+        if processed is not None:
+            if processed.lower() not in BOOLEAN_PARAMS:
+                return Response({"error": "processed must be true or false"}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(processed=BOOLEAN_PARAMS[processed.lower()])
         try:
-            user = request.user
-            return Response({"first_name": user.first_name, "last_name": user.last_name, "email": user.email,
-                             "mobile": user.mobile, "organisation_name": user.organisation_name}, )
-        except ObjectDoesNotExist:
-            return Response({"error": "Wrong Credentials"}, status=status.HTTP_400_BAD_REQUEST)
+            if created_after is not None:
+                queryset = queryset.filter(created_at__date__gte=created_after)
+            if created_before is not None:
+                queryset = queryset.filter(created_at__date__lte=created_before)
+        except ValidationError as e:
+            return Response({"error": e.messages}, status=status.HTTP_400_BAD_REQUEST)
+
+        return stream_csv(queryset, columns, f"{lead_type}-requests")
+
 
+class MetricsView(APIView):
+    """
+    Staff only request metrics of this instance in the Prometheus text format
+    """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request,):
+        return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 class ChatbotRequest(generics.CreateAPIView):
     """
-    Allows to post chatbot requests
+    Allows to post chatbot requests, admins are notified by email/sms in the background
     """
-    # TODO: send sms/email to admin
     serializer_class = ChatbotRequestSerializer
 
     def perform_create(self, serializer):
         instance = serializer.save()
-        admin_list = list(ChatbotNotification.objects.all())
-        send_notification(admin_list)
+        transaction.on_commit(lambda: notification_dispatcher.notify_chatbot_request(instance))
 
 